@@ -1,8 +1,6 @@
 """Default values and constants"""
-from shutil import get_terminal_size
+# pylint: disable=import-outside-toplevel
 import click
-from six import string_types
-from voluptuous import All, Any, Coerce, Optional, Schema
 
 # pylint: disable=E1120
 
@@ -14,6 +12,65 @@ EPILOG = 'Learn more at https://github.com/untergeek/es-timeslicer'
 
 HELP_OPTIONS = {'help_option_names': ['-h', '--help']}
 
+# Larger than any terminal. Click caps help output at the real terminal width, which it only
+# measures when help is actually rendered.
+MAX_CONTENT_WIDTH = 10000
+
+# These mirror ``es_client.defaults.CLICK_OPTIONS``. They are kept here so the command-line
+# interface can be built without importing es_client, which in turn imports the whole
+# Elasticsearch client.
+CLIENT_OPTIONS = {
+    'config': {'help': 'Path to configuration file.', 'type': click.Path(exists=True)},
+    'hosts': {'help': 'Elasticsearch URL to connect to.', 'multiple': True},
+    'cloud_id': {'help': 'Elastic Cloud instance id'},
+    'api_token': {'help': 'The base64 encoded API Key token', 'type': str},
+    'id': {'help': 'API Key "id" value', 'type': str},
+    'api_key': {'help': 'API Key "api_key" value', 'type': str},
+    'username': {'help': 'Elasticsearch username', 'type': str},
+    'password': {'help': 'Elasticsearch password', 'type': str},
+    'bearer_auth': {'help': 'Bearer authentication token', 'type': str, 'hidden': True},
+    'opaque_id': {'help': 'X-Opaque-Id HTTP header value', 'type': str, 'hidden': True},
+    'request_timeout': {'help': 'Request timeout in seconds', 'type': float},
+    'http_compress': {
+        'help': 'Enable HTTP compression',
+        'default': False,
+        'show_default': True,
+        'hidden': True,
+    },
+    'verify_certs': {
+        'help': 'Verify SSL/TLS certificate(s)', 'default': True, 'show_default': True},
+    'ca_certs': {'help': 'Path to CA certificate file or directory', 'type': str},
+    'client_cert': {'help': 'Path to client certificate file', 'type': str},
+    'client_key': {'help': 'Path to client key file', 'type': str},
+    'ssl_assert_hostname': {
+        'help': "Hostname or IP address to verify on the node's certificate.",
+        'type': str,
+        'hidden': True
+    },
+    'ssl_assert_fingerprint': {
+        'help': (
+            "SHA-256 fingerprint of the node's certificate. If this value is given then "
+            "root-of-trust verification isn't done and only the node's certificate fingerprint "
+            "is verified."
+            ),
+        'type': str,
+        'hidden': True
+    },
+    'ssl_version': {'help': 'Minimum acceptable TLS/SSL version', 'type': str, 'hidden': True},
+    'master-only': {
+        'help': 'Only run if the single host provided is the elected master',
+        'default': False,
+        'show_default': True,
+        'hidden': True
+    },
+    'skip_version_test': {
+        'help': 'Elasticsearch version compatibility check',
+        'default': False,
+        'show_default': True,
+        'hidden': True
+    }
+}
+
 CLI_OPTIONS = {
     'loglevel': {
         'help': 'Log level',
@@ -26,7 +83,13 @@ CLI_OPTIONS = {
     },
     'show_hidden': {'help': 'Show all options', 'is_flag': True, 'default': False},
     'read_index': {'help': 'The index to query', 'required': True},
-    'write_index': {'help': 'The target index', 'required': True},
+    'write_index': {
+        'help': (
+            'The target index, alias, or data stream. May be a template formatted with the time '
+            'slice bounds, e.g. rollup-{slice_start:%Y.%m.%d}'
+        ),
+        'required': True
+    },
     'pipeline': {
         'help': 'Send to the named pipeline', 'type': str, 'required': False, 'default': None},
     'field': {'help': 'The timestamp field name', 'default': '@timestamp', 'show_default': True},
@@ -44,13 +107,73 @@ CLI_OPTIONS = {
         'default': 1,
         'show_default': True
     },
+    'interval': {
+        'help': (
+            'Time slice interval with a unit, e.g. 15m, 1h, 1d, 1w, 1M, 1q, 1y. Overrides '
+            '--increment. Days and longer are calendar units in --time_zone'
+        ),
+        'type': str,
+        'default': None
+    },
+    'time_zone': {
+        'help': (
+            'Time zone name (e.g. Europe/Berlin) for calendar intervals, alignment, and the '
+            'time slice dates. Defaults to the time zone of --end_time, or UTC'
+        ),
+        'type': str,
+        'default': None
+    },
+    'align': {
+        'help': 'Align time slices to interval boundaries, e.g. midnight or the top of the hour',
+        'is_flag': True,
+        'default': False
+    },
+    'newest_first': {
+        'help': 'Process the newest time slice first',
+        'is_flag': True,
+        'default': False
+    },
     'agg_function': {
         'help': 'File with a single Python function that prepares and formats documents',
         'type': str,
         'required': True
     },
     'dry_run': {
-        'help': 'Do a dry-run, and output a few results to the console as a test',
+        'help': (
+            'Do a dry-run: search (or, in replay, read) a sample of time slices without '
+            'writing, preview a few results, and estimate the cost of the full run'
+        ),
+        'is_flag': True,
+        'default': False
+    },
+    'sample_slices': {
+        'help': 'Number of time slices, spread across the window, sampled by --dry_run',
+        'type': click.IntRange(min=1),
+        'default': 10,
+        'show_default': True
+    },
+    'prune_indices': {
+        'help': (
+            'Look up the time range of each index behind read_index before the run, and search '
+            'each time slice only on the indices it overlaps'
+        ),
+        'is_flag': True,
+        'default': False
+    },
+    'pushdown': {
+        'help': (
+            'Run the "pushdown" mapping in the query file server-side as a transform, instead '
+            'of the agg_function. Falls back to the agg_function if that is not possible'
+        ),
+        'is_flag': True,
+        'default': False
+    },
+    'stream': {
+        'help': (
+            'Parse search responses incrementally. The agg_function gets the iterator over the '
+            'buckets of the top-level aggregation as result["buckets"], in place of '
+            'result["aggregations"][name]["buckets"], and may return a generator. Requires ijson'
+        ),
         'is_flag': True,
         'default': False
     },
@@ -59,11 +182,119 @@ CLI_OPTIONS = {
         'is_flag': True,
         'default': False
     },
+    'trace_every': {
+        'help': 'With --trace, trace only every Nth time slice',
+        'type': click.IntRange(min=1),
+        'default': 1,
+        'show_default': True
+    },
+    'id_key': {
+        'help': (
+            'Document key path (dot notation) used to build a deterministic _id. '
+            'May be used multiple times'
+        ),
+        'type': str,
+        'multiple': True,
+    },
+    'op_type': {
+        'help': 'Bulk operation type for documents with a deterministic _id',
+        'type': click.Choice(['index', 'create']),
+        'default': 'index',
+        'show_default': True
+    },
+    'max_concurrency': {
+        'help': 'Maximum number of time slices processed concurrently',
+        'type': click.IntRange(min=1),
+        'default': 1,
+        'show_default': True
+    },
+    'max_rate': {
+        'help': 'Maximum requests per second sent to Elasticsearch (search and bulk combined)',
+        'type': click.FloatRange(min=0, min_open=True),
+        'default': None
+    },
+    'connections_per_node': {
+        'help': (
+            'HTTP connection pool size per node. Defaults to 10, or max_concurrency if larger, '
+            'up to 100'
+        ),
+        'type': click.IntRange(min=1, max=100),
+        'default': None
+    },
+    'index_settings': {
+        'help': 'JSON file with the settings and mappings used to create missing write indices',
+        'type': str,
+        'default': None
+    },
+    'bulk_load_mode': {
+        'help': (
+            'Set refresh_interval to -1 and replicas to 0 on the write indices for the run, '
+            'and restore the original settings at the end'
+        ),
+        'is_flag': True,
+        'default': False
+    },
+    'force_merge': {
+        'help': 'With --bulk_load_mode, force-merge the write indices to one segment at the end',
+        'is_flag': True,
+        'default': False
+    },
+    'sink': {
+        'help': 'Where to write the documents',
+        'type': click.Choice(['elasticsearch', 'ndjson', 'parquet', 'arrow']),
+        'default': 'elasticsearch',
+        'show_default': True
+    },
+    'output_path': {
+        'help': 'Output directory for the ndjson, parquet, and arrow sinks',
+        'type': str,
+        'default': '.',
+        'show_default': True
+    },
+    'max_file_size': {
+        'help': 'Roll over to a new output file after this many megabytes',
+        'type': click.IntRange(min=1),
+        'default': 256,
+        'show_default': True
+    },
+    'compress': {
+        'help': 'Gzip compress ndjson output files',
+        'default': True,
+        'show_default': True
+    },
+    'record': {
+        'help': 'Record every search response to this archive file, for use with replay',
+        'type': str,
+        'default': None
+    },
+    'plan': {
+        'help': 'Re-run plan written by verify: process only the time slices it lists',
+        'type': str,
+        'default': None
+    },
+    'write_field': {
+        'help': 'The timestamp field name in write_index, if it differs from --field',
+        'type': str,
+        'default': None
+    },
+    'count_field': {
+        'help': (
+            'Numeric field in write_index holding the number of source documents of each '
+            'document (e.g. doc_count). The slice counts are then compared exactly'
+        ),
+        'type': str,
+        'default': None
+    },
+    'exact': {
+        'help': 'Compare the raw document counts of each time slice exactly, for 1:1 copies',
+        'is_flag': True,
+        'default': False
+    },
 }
 
 def click_options():
-    """Return the max version"""
-    return CLI_OPTIONS
+    """Return all Click option settings"""
+    return {**CLIENT_OPTIONS, **CLI_OPTIONS}
 
 # Configuration file: logging
 def config_logging():
@@ -82,6 +313,8 @@ def config_logging():
         the default values set.
     :rtype: :py:class:`~.voluptuous.schema_builder.Schema`
     """
+    from six import string_types
+    from voluptuous import All, Any, Coerce, Optional, Schema
     return Schema(
         {
             Optional('loglevel', default='INFO'):
@@ -100,5 +333,5 @@ def get_context_settings():
     return {**get_width(), **HELP_OPTIONS}
 
 def get_width():
-    """Determine terminal width"""
-    return {"max_content_width": get_terminal_size()[0]}
+    """Let Click size help output to the terminal width when it is rendered"""
+    return {"max_content_width": MAX_CONTENT_WIDTH}
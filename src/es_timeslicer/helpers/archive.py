@@ -0,0 +1,128 @@
+"""Record search responses to a local archive, and read them back for replay"""
+import json
+import logging
+import mmap
+import threading
+import zlib
+from es_timeslicer.exceptions import ConfigurationException
+
+LOGGER = logging.getLogger(__name__)
+
+ARCHIVE_VERSION = 1
+#: Bytes read at a time when compressing a response body file
+CHUNK = 1024 * 1024
+
+def index_path(path):
+    """Return the path of the index file belonging to archive path"""
+    return f'{path}.idx'
+
+class ArchiveWriter:
+    """
+    Append each time slice's search response to an archive file as an independently
+    zlib-compressed JSON blob.
+
+    The index file (``<path>.idx``) is newline-delimited JSON. The first line holds the
+    archive metadata, and every following line the ``begin``, ``end``, ``offset`` and
+    ``length`` of one slice, so any slice can be read by seeking directly to it.
+    """
+    def __init__(self, path, metadata):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            # pylint: disable=consider-using-with
+            self.datafile = open(path, 'wb')
+            self.indexfile = open(index_path(path), 'w', encoding='utf8')
+        except OSError as exc:
+            msg = f'Unable to create archive "{path}": {exc}'
+            LOGGER.critical(msg)
+            raise ConfigurationException(msg) from exc
+        self.indexfile.write(json.dumps({'version': ARCHIVE_VERSION, **metadata}) + '\n')
+        self.offset = 0
+
+    def add(self, begin, end, result):
+        """
+        Append the search result for the slice from begin to end. result may also be the raw
+        response body, bytes or a file, as read in stream mode. A file is compressed as it is
+        read.
+        """
+        if hasattr(result, 'read'):
+            result.seek(0)
+            compressor = zlib.compressobj()
+            chunks = [compressor.compress(chunk) for chunk in iter(lambda: result.read(CHUNK), b'')]
+            blob = b''.join(chunks) + compressor.flush()
+        else:
+            if not isinstance(result, bytes):
+                result = json.dumps(result, separators=(',', ':')).encode('utf-8')
+            blob = zlib.compress(result)
+        with self.lock:
+            self.datafile.write(blob)
+            entry = {'begin': begin, 'end': end, 'offset': self.offset, 'length': len(blob)}
+            self.indexfile.write(json.dumps(entry) + '\n')
+            self.offset += len(blob)
+
+    def close(self):
+        """Close the archive and index files"""
+        with self.lock:
+            self.datafile.close()
+            self.indexfile.close()
+
+class ArchiveReader:
+    """
+    Read an archive written by :py:class:`ArchiveWriter`. The archive is memory-mapped, so only
+    the slices being read are paged in, no matter how large the archive is.
+    """
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(index_path(path), 'r', encoding='utf8') as indexfile:
+                self.metadata = json.loads(indexfile.readline())
+                self.entries = [json.loads(line) for line in indexfile if line.strip()]
+            # pylint: disable=consider-using-with
+            self.datafile = open(path, 'rb')
+        except (OSError, ValueError) as exc:
+            msg = f'Unable to read archive "{path}": {exc}'
+            LOGGER.critical(msg)
+            raise ConfigurationException(msg) from exc
+        if self.metadata.get('version') != ARCHIVE_VERSION:
+            msg = f'Unsupported archive version: {self.metadata.get("version")}'
+            LOGGER.critical(msg)
+            raise ConfigurationException(msg)
+        # Slices recorded concurrently may be out of order
+        self.entries.sort(key=lambda entry: entry['begin'])
+        self.data = None
+        if self.entries:
+            self.data = mmap.mmap(self.datafile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __iter__(self):
+        """Yield (begin, end, result) for every slice in the archive, oldest first"""
+        return self.slices()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        """Close the memory map and the archive file"""
+        if self.data is not None:
+            self.data.close()
+        self.datafile.close()
+
+    def get(self, begin):
+        """Return the search result of the slice starting at begin, or None"""
+        for entry in self.entries:
+            if entry['begin'] == begin:
+                return self.read(entry)
+        return None
+
+    def read(self, entry, raw=False):
+        """
+        Return the decompressed search result for an index entry, or its undecoded bytes if raw
+        is True
+        """
+        start = entry['offset']
+        data = zlib.decompress(self.data[start:start + entry['length']])
+        return data if raw else json.loads(data)
+
+    def slices(self, raw=False):
+        """Yield (begin, end, result) for every slice in the archive, oldest first"""
+        for entry in self.entries:
+            yield entry['begin'], entry['end'], self.read(entry, raw=raw)
@@ -0,0 +1,105 @@
+"""Tune write indices for bulk loading, and restore their settings afterwards"""
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+#: The settings changed for the duration of a bulk load, and the values they are set to
+BULK_SETTINGS = {'index.refresh_interval': '-1', 'index.number_of_replicas': '0'}
+
+class BulkLoader:
+    """
+    Disable refreshes and replicas on each write index for the duration of a run, recording the
+    original values so :py:meth:`restore` can put them back. The original values are also logged,
+    so they can be restored by hand if the process is killed.
+
+    A name which is an alias or data stream is tuned for its write index only, so the replicas
+    of its older indices are left alone.
+    """
+    def __init__(self, client, force_merge=False):
+        self.client = client
+        self.force_merge = force_merge
+        #: Attribute. The original settings of each tuned index. None means the default.
+        self.original = {}
+        self.restored = set()
+        #: Attribute. Seconds spent tuning, force-merging, and restoring
+        self.seconds = {'tune': 0.0, 'forcemerge': 0.0, 'restore': 0.0}
+        self.lock = threading.Lock()
+
+    def get_write_index(self, name, kind):
+        """
+        Return the concrete index which documents written to name (an index, alias or data
+        stream, per kind) go to, or None if there is none
+        """
+        if kind == 'data_stream':
+            streams = self.client.indices.get_data_stream(name=name)['data_streams']
+            # The newest backing index is the write index
+            return streams[0]['indices'][-1]['index_name'] if streams else None
+        if kind == 'alias':
+            indices = self.client.indices.get_alias(name=name)
+            if len(indices) == 1:
+                return next(iter(indices))
+            for index, body in indices.items():
+                if body.get('aliases', {}).get(name, {}).get('is_write_index'):
+                    return index
+            return None
+        return name
+
+    def restore(self):
+        """Force-merge (if enabled) and restore the original settings of every tuned index"""
+        with self.lock:
+            indices = [index for index in self.original if index not in self.restored]
+            if not indices:
+                return
+            if self.force_merge:
+                start = time.monotonic()
+                LOGGER.info('Force-merging %d index(es) to one segment', len(indices))
+                try:
+                    self.client.indices.forcemerge(index=','.join(indices), max_num_segments=1)
+                except Exception as exc: # pylint: disable=broad-exception-caught
+                    LOGGER.error('Force merge failed: %s', exc)
+                self.seconds['forcemerge'] += time.monotonic() - start
+            start = time.monotonic()
+            for index in indices:
+                LOGGER.info('Restoring settings of %s: %s', index, self.original[index])
+                try:
+                    self.client.indices.put_settings(index=index, settings=self.original[index])
+                    self.restored.add(index)
+                except Exception as exc: # pylint: disable=broad-exception-caught
+                    LOGGER.critical(
+                        'Unable to restore settings of %s. Restore %s by hand. Error: %s',
+                        index, self.original[index], exc)
+            self.seconds['restore'] += time.monotonic() - start
+
+    def summary(self):
+        """Return a list of lines describing the settings changes and the time spent"""
+        lines = []
+        for index, settings in sorted(self.original.items()):
+            changes = ', '.join(
+                f'{key.split(".")[-1]} {settings[key] or "default"} -> {value}'
+                for key, value in BULK_SETTINGS.items())
+            state = 'restored' if index in self.restored else 'NOT RESTORED'
+            lines.append(f'{index}: {changes} ({state})')
+        lines.append(', '.join(f'{key} {value:.3f}s' for key, value in self.seconds.items()))
+        return lines
+
+    def tune(self, name, kind='index'):
+        """
+        Record the current settings of the write index behind name, an index, alias or data
+        stream (per kind), and apply BULK_SETTINGS
+        """
+        with self.lock:
+            start = time.monotonic()
+            index = self.get_write_index(name, kind)
+            if index is None:
+                LOGGER.warning('%s %s has no write index. Not tuning it.', kind, name)
+            elif index not in self.original:
+                current = self.client.indices.get_settings(
+                    index=index, name=list(BULK_SETTINGS), flat_settings=True)
+                settings = current.get(index, {}).get('settings', {})
+                self.original[index] = {key: settings.get(key) for key in BULK_SETTINGS}
+                LOGGER.info('Bulk-load mode for %s. Original settings: %s',
+                    index, self.original[index])
+                self.client.indices.put_settings(index=index, settings=BULK_SETTINGS)
+            self.seconds['tune'] += time.monotonic() - start
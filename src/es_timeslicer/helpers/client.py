@@ -1,14 +1,60 @@
 """Client builder helper functions"""
 import logging
+import threading
+from copy import deepcopy
+from pathlib import Path
 from es_client.builder import Builder, ClientArgs, OtherArgs
 from es_client.defaults import CLIENT_SETTINGS, VERSION_MAX, VERSION_MIN
 from es_client.exceptions import ConfigurationError
 from es_client.helpers import utils as escl
 from es_timeslicer.exceptions import ClientException, ConfigurationException
 from es_timeslicer.helpers.logging import check_logging_config, set_logging
+from es_timeslicer.helpers.utils import get_fingerprint
 
 LOGGER = logging.getLogger(__name__)
 
+# Process-level caches, so multi-step and batch invocations only read and validate the
+# configuration, and connect to Elasticsearch, once per unique configuration
+CLIENTS = {}
+CONFIGS = {}
+CONFIGDICTS = {}
+VERIFIED = set()
+CACHE_LOCK = threading.RLock()
+
+def client_factory(params, connections_per_node=None, skip_version_probe=True):
+    """
+    Return a connected client for the command-line client ``params``, reusing the client
+    already connected in this process for the same configuration.
+
+    :param params: The top-level command-line parameters
+    :param connections_per_node: HTTP connection pool size per node. None uses the client
+        default (10), which is too small for high concurrency.
+    :param skip_version_probe: Skip the version check when building another client for a
+        cluster which was already checked in this process, e.g. with a different pool size
+
+    :type params: dict
+    :type connections_per_node: int
+    :type skip_version_probe: bool
+
+    :returns: A client connection object
+    :rtype: :py:class:`~.elasticsearch.Elasticsearch`
+    """
+    configdict = get_configdict(params)
+    cluster = get_fingerprint(configdict)
+    if connections_per_node:
+        configdict['elasticsearch']['client']['connections_per_node'] = connections_per_node
+    key = get_fingerprint(configdict)
+    with CACHE_LOCK:
+        if key in CLIENTS:
+            LOGGER.debug('Reusing connected client')
+            return CLIENTS[key]
+        if skip_version_probe and cluster in VERIFIED:
+            LOGGER.debug('Version already verified for this cluster. Skipping the version check')
+            configdict['elasticsearch']['other_settings']['skip_version_test'] = True
+        CLIENTS[key] = get_client(configdict=configdict)
+        VERIFIED.add(cluster)
+        return CLIENTS[key]
+
 def cloud_id_override(args, params, client_args):
     """
     If hosts are in the config file, but cloud_id is specified at the command-line,
@@ -100,12 +146,38 @@ def get_client(
     return builder.client
 
 def get_config(params):
-    """If params['config'] is a valid path, return the validated dictionary from the YAML"""
+    """
+    If params['config'] is a valid path, return the dictionary from the YAML. Files are read
+    once per process, unless they change.
+    """
     config = {'config':{}} # Set a default empty value
     if params['config']:
-        config = escl.get_yaml(params['config'])
+        path = Path(params['config'])
+        key = (str(path.resolve()), path.stat().st_mtime_ns)
+        with CACHE_LOCK:
+            if key not in CONFIGS:
+                CONFIGS[key] = escl.get_yaml(params['config'])
+            config = deepcopy(CONFIGS[key])
     return config
 
+def get_configdict(params):
+    """
+    Return the client configuration dictionary built from ``params``, with settings from the
+    configuration file overridden by command-line values. The result is cached per unique set
+    of ``params``, and a copy is returned.
+    """
+    key = get_fingerprint(params)
+    with CACHE_LOCK:
+        if key not in CONFIGDICTS:
+            client_args, other_args = get_args(params)
+            CONFIGDICTS[key] = {
+                'elasticsearch': {
+                    'client': escl.prune_nones(client_args.asdict()),
+                    'other_settings': escl.prune_nones(other_args.asdict())
+                }
+            }
+        return deepcopy(CONFIGDICTS[key])
+
 def get_hosts(params):
     """Return hostlist for client object"""
     hostslist = []
@@ -1,17 +1,20 @@
 """Sub-commands for Click CLI"""
+# The Elasticsearch client and the main app are imported by the commands which need them, so
+# that --help and other short invocations start quickly.
+# pylint: disable=import-outside-toplevel
+import json
 import logging
 import click
-from es_client.helpers import utils as escl
 from es_timeslicer.defaults import FILEPATH_OVERRIDE, EPILOG, get_context_settings
 from es_timeslicer.exceptions import FatalException
-from es_timeslicer.helpers.client import get_args, get_client
-from es_timeslicer.helpers.utils import cli_opts, is_docker
-from es_timeslicer.main import TimeSlicer
+from es_timeslicer.helpers.archive import ArchiveReader
+from es_timeslicer.helpers.utils import cli_opts, is_docker, option_wrapper
 
 LOGGER = logging.getLogger(__name__)
 
 ONOFF = {'on': 'show-', 'off': 'hide-'}
-click_opt_wrap = escl.option_wrapper()
+YESNO = {'on': '', 'off': 'no-'}
+click_opt_wrap = option_wrapper()
 
 def override_filepath():
     """Override the default filepath if we're running Docker"""
@@ -28,20 +31,47 @@ def override_filepath():
 @click_opt_wrap(*cli_opts('start_time'))
 @click_opt_wrap(*cli_opts('end_time'))
 @click_opt_wrap(*cli_opts('increment')) # in minutes
+@click_opt_wrap(*cli_opts('interval'))
+@click_opt_wrap(*cli_opts('time_zone'))
+@click_opt_wrap(*cli_opts('align'))
+@click_opt_wrap(*cli_opts('newest_first'))
 @click_opt_wrap(*cli_opts('agg_function'))
 @click_opt_wrap(*cli_opts('dry_run'))
+@click_opt_wrap(*cli_opts('sample_slices'))
+@click_opt_wrap(*cli_opts('prune_indices'))
+@click_opt_wrap(*cli_opts('pushdown'))
+@click_opt_wrap(*cli_opts('stream'))
 @click_opt_wrap(*cli_opts('trace'))
+@click_opt_wrap(*cli_opts('trace_every'))
+@click_opt_wrap(*cli_opts('id_key'))
+@click_opt_wrap(*cli_opts('op_type'))
+@click_opt_wrap(*cli_opts('max_concurrency'))
+@click_opt_wrap(*cli_opts('max_rate'))
+@click_opt_wrap(*cli_opts('connections_per_node'))
+@click_opt_wrap(*cli_opts('index_settings'))
+@click_opt_wrap(*cli_opts('bulk_load_mode'))
+@click_opt_wrap(*cli_opts('force_merge'))
+@click_opt_wrap(*cli_opts('sink'))
+@click_opt_wrap(*cli_opts('output_path', override=override_filepath()))
+@click_opt_wrap(*cli_opts('max_file_size'))
+@click_opt_wrap(*cli_opts('compress', onoff=YESNO))
+@click_opt_wrap(*cli_opts('record'))
+@click_opt_wrap(*cli_opts('plan'))
 @click.argument('query_file', type=str, nargs=1)
 @click.pass_context
 def query(
-    ctx, read_index, write_index, pipeline, field, start_time, end_time, increment, agg_function,
-    dry_run, trace, query_file):
+    ctx, read_index, write_index, pipeline, field, start_time, end_time, increment, interval,
+    time_zone, align, newest_first, agg_function, dry_run, sample_slices, prune_indices,
+    pushdown, stream, trace, trace_every, id_key, op_type, max_concurrency, max_rate,
+    connections_per_node, index_settings, bulk_load_mode, force_merge, sink, output_path,
+    max_file_size, compress, record, plan, query_file):
     """
     Repeatedly execute the query in QUERY_FILE using the defined parameters.
 
     $ es-timeslicer query [OPTIONS] QUERY_FILE
     """
     LOGGER.debug('Entering function "query"')
+    from es_timeslicer.main import TimeSlicer
     tslicer = TimeSlicer(ctx.parent.params, ctx.params)
     try:
         tslicer.loop_query()
@@ -50,6 +80,57 @@ def query(
         LOGGER.critical('Unable to continue. Exiting.')
         raise FatalException from exc
 
+@click.command(context_settings=get_context_settings(), epilog=EPILOG)
+@click_opt_wrap(*cli_opts('write_index', override={'required': False}))
+@click_opt_wrap(*cli_opts('pipeline'))
+@click_opt_wrap(*cli_opts('agg_function'))
+@click_opt_wrap(*cli_opts('dry_run'))
+@click_opt_wrap(*cli_opts('sample_slices'))
+@click_opt_wrap(*cli_opts('stream'))
+@click_opt_wrap(*cli_opts('trace'))
+@click_opt_wrap(*cli_opts('trace_every'))
+@click_opt_wrap(*cli_opts('id_key'))
+@click_opt_wrap(*cli_opts('op_type'))
+@click_opt_wrap(*cli_opts('max_rate'))
+@click_opt_wrap(*cli_opts('index_settings'))
+@click_opt_wrap(*cli_opts('bulk_load_mode'))
+@click_opt_wrap(*cli_opts('force_merge'))
+@click_opt_wrap(*cli_opts('sink'))
+@click_opt_wrap(*cli_opts('output_path', override=override_filepath()))
+@click_opt_wrap(*cli_opts('max_file_size'))
+@click_opt_wrap(*cli_opts('compress', onoff=YESNO))
+@click.argument('archive', type=str, nargs=1)
+@click.pass_context
+def replay(
+    ctx, write_index, pipeline, agg_function, dry_run, sample_slices, stream, trace,
+    trace_every, id_key, op_type, max_rate, index_settings, bulk_load_mode, force_merge, sink,
+    output_path, max_file_size, compress, archive):
+    """
+    Run the agg_function against the search responses recorded in ARCHIVE by
+    query --record ARCHIVE. No searches are sent to Elasticsearch.
+
+    $ es-timeslicer replay [OPTIONS] ARCHIVE
+
+    Query parameters (read_index, field, time window, increment) come from the archive.
+    write_index and pipeline default to the recorded values. With --dry_run, a sample of the
+    recorded time slices is transformed, as with query --dry_run, and nothing is written.
+    """
+    LOGGER.debug('Entering function "replay"')
+    from es_timeslicer.main import TimeSlicer
+    reader = ArchiveReader(archive)
+    recorded = reader.metadata['params']
+    params = {**recorded, **ctx.params, 'record': None, 'max_concurrency': 1}
+    for key in ['write_index', 'pipeline']:
+        if params[key] is None:
+            params[key] = recorded[key]
+    tslicer = TimeSlicer(ctx.parent.params, params)
+    try:
+        tslicer.replay(reader)
+    except Exception as exc:
+        LOGGER.critical('Error encountered during execution: %s', exc)
+        LOGGER.critical('Unable to continue. Exiting.')
+        raise FatalException from exc
+
 @click.command(context_settings=get_context_settings(), epilog=EPILOG)
 @click.argument('search_pattern', type=str, nargs=1)
 @click.pass_context
@@ -61,14 +142,9 @@ def show_indices(ctx, search_pattern):
 
     This is included as a way to ensure you are seeing the indices you expect.
     """
-    client_args, other_args = get_args(ctx.parent.params)
+    from es_timeslicer.helpers.client import client_factory
     try:
-        client = get_client(configdict={
-            'elasticsearch': {
-                'client': escl.prune_nones(client_args.asdict()),
-                'other_settings': escl.prune_nones(other_args.asdict())
-            }
-        })
+        client = client_factory(ctx.parent.params)
     except Exception as exc:
         LOGGER.critical('Exception encountered: %s', exc)
         raise FatalException from exc
@@ -91,3 +167,64 @@ def show_indices(ctx, search_pattern):
         click.secho(': ')
         for idx in indices:
             click.secho(idx)
+
+@click.command(context_settings=get_context_settings(), epilog=EPILOG)
+@click_opt_wrap(*cli_opts('read_index'))
+@click_opt_wrap(*cli_opts('write_index'))
+@click_opt_wrap(*cli_opts('field'))
+@click_opt_wrap(*cli_opts('write_field'))
+@click_opt_wrap(*cli_opts('start_time'))
+@click_opt_wrap(*cli_opts('end_time'))
+@click_opt_wrap(*cli_opts('increment')) # in minutes
+@click_opt_wrap(*cli_opts('interval'))
+@click_opt_wrap(*cli_opts('time_zone'))
+@click_opt_wrap(*cli_opts('align'))
+@click_opt_wrap(*cli_opts('count_field'))
+@click_opt_wrap(*cli_opts('exact'))
+@click.argument('query_file', type=str, nargs=1, required=False)
+@click.pass_context
+def verify(
+    ctx, read_index, write_index, field, write_field, start_time, end_time, increment,
+    interval, time_zone, align, count_field, exact, query_file):
+    """
+    Compare the per-slice document counts of read_index and write_index, and output every time
+    slice which is missing or mismatched, one JSON object per line.
+
+    $ es-timeslicer verify [OPTIONS] [QUERY_FILE]
+
+    Use the same time slice options (increment or interval, time_zone, align) as the run.
+    The output is a re-run plan: pass it to query --plan to process only those time slices.
+    The query in QUERY_FILE, if given, filters the documents counted in read_index. Unless
+    --count_field or --exact is used, only slices with no documents on one side are reported.
+    The exit code is 1 if any slice is reported.
+    """
+    LOGGER.debug('Entering function "verify"')
+    from es_timeslicer.helpers.client import client_factory
+    from es_timeslicer.helpers.slices import SlicePlan
+    from es_timeslicer.helpers.utils import read_queryfile
+    from es_timeslicer.helpers.verify import compare, count_slices, get_pattern, get_slice
+    query_filter = read_queryfile(query_file).get('query') if query_file else None
+    # The time slices run from end_time (oldest) to start_time (newest)
+    plan = SlicePlan(end_time, start_time, interval or increment, tz=time_zone, align=align)
+    try:
+        client = client_factory(ctx.parent.params)
+        read_counts = count_slices(client, read_index, field, plan, query=query_filter)
+        write_counts = count_slices(
+            client, get_pattern(write_index), write_field or field, plan,
+            count_field=count_field)
+    except Exception as exc:
+        LOGGER.critical('Exception encountered: %s', exc)
+        raise FatalException from exc
+    broken = 0
+    for key, read, write, status in compare(
+            read_counts, write_counts, exact=bool(exact or count_field)):
+        broken += 1
+        slice_begin, slice_end = get_slice(plan, key)
+        click.echo(json.dumps({
+            'begin': slice_begin, 'end': slice_end, 'status': status, 'read': read,
+            'write': write}))
+    LOGGER.info(
+        'Verified %d time slice(s) with documents: %d missing or mismatched',
+        len(set(read_counts) | set(write_counts)), broken)
+    if broken:
+        ctx.exit(1)
@@ -1,13 +1,20 @@
 """Logging helpers"""
+# pylint: disable=import-outside-toplevel
+import atexit
+import copy
+import json
 import sys
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
 import click
-import ecs_logging
-from es_client.helpers.schemacheck import SchemaCheck
-from es_client.helpers.utils import ensure_list, prune_nones
 from es_timeslicer.defaults import config_logging
+from es_timeslicer.exceptions import ConfigurationException
 from es_timeslicer.helpers.utils import is_docker
 
+#: Log records queued for output at most. Beyond that, logging blocks until output catches up.
+QUEUE_SIZE = 10000
+
 class Whitelist(logging.Filter):
     """How to whitelist logs"""
     # pylint: disable=super-init-not-called
@@ -22,6 +29,38 @@ class Blacklist(Whitelist):
     def filter(self, record):
         return not Whitelist.filter(self, record)
 
+class LogQueueHandler(QueueHandler):
+    """
+    QueueHandler which keeps exc_info, so the formatter on the listener side (e.g. ECS) still
+    gets the exception, and which blocks while the queue is full instead of dropping records
+    """
+    def enqueue(self, record):
+        self.queue.put(record)
+
+    def prepare(self, record):
+        # Render the message here, as its arguments may change once this thread moves on
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+class LogQueueListener(QueueListener):
+    """QueueListener which waits for room in a full queue to stop"""
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+class LazyJson:
+    """
+    Log message argument which is only rendered as indented JSON if the record is emitted, e.g.
+    ``logger.debug('TRACE: REQUEST: \\n%s', LazyJson(request))``
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, indent=2, default=str)
+
 class LogInfo:
     """Logging Class"""
     def __init__(self, cfg):
@@ -44,33 +83,33 @@ class LogInfo:
             raise ValueError(msg)
 
         #: Attribute. Which logging handler to use
-        if is_docker():
+        if cfg['logfile']:
+            self.handler = logging.FileHandler(cfg['logfile'])
+        elif is_docker():
             self.handler = logging.FileHandler('/proc/1/fd/1')
         else:
             self.handler = logging.StreamHandler(stream=sys.stdout)
-        if cfg['logfile']:
-            self.handler = logging.FileHandler(cfg['logfile'])
 
         if self.numeric_log_level == 10: # DEBUG
             self.format_string = (
                 '%(asctime)s %(levelname)-9s %(name)22s %(funcName)22s:%(lineno)-4d %(message)s')
 
         if cfg['logformat'] == 'ecs':
+            import ecs_logging
             self.handler.setFormatter(ecs_logging.StdlibFormatter())
         else:
             self.handler.setFormatter(logging.Formatter(self.format_string))
 
 def check_logging_config(config):
     """
-    Ensure that the top-level key ``logging`` is in ``config`` before passing it to
-    :py:class:`~.es_client.helpers.schemacheck.SchemaCheck` for value validation.
+    Ensure that the top-level key ``logging`` is in ``config`` before validating its values with
+    the :py:func:`~.es_timeslicer.defaults.config_logging` schema.
 
     :param config: Logging configuration data
 
     :type config: dict
 
-    :returns: :py:class:`~.es_client.helpers.schemacheck.SchemaCheck` validated logging
-        configuration.
+    :returns: Validated logging configuration, with default values set.
     """
 
     if not isinstance(config, dict):
@@ -85,11 +124,17 @@ def check_logging_config(config):
         log_settings = {}
     else:
         if config['logging']:
-            log_settings = prune_nones(config['logging'])
+            log_settings = {k: v for k, v in config['logging'].items() if v is not None}
         else:
             log_settings = {}
-    return SchemaCheck(
-        log_settings, config_logging(), 'Logging Configuration', 'logging').result()
+    # Validated with voluptuous directly, as importing es_client means importing the whole
+    # Elasticsearch client
+    from voluptuous import Invalid
+    try:
+        return config_logging()(log_settings)
+    except Invalid as exc:
+        msg = f'Logging Configuration: Location: logging: {exc}'
+        raise ConfigurationException(msg) from exc
 
 def override_logging(config, loglevel, logfile, logformat):
     """Get logging config and override from command-line options
@@ -128,15 +173,23 @@ def set_logging(log_opts):
 
     :rtype: None
     """
-    # Set up logging
+    # Set up logging. Messages are rendered by a QueueHandler in the thread that logs them, and
+    # formatted and written by a QueueListener thread, so slow output (e.g. /proc/1/fd/1 under
+    # Docker) does not block the time slice loop until QUEUE_SIZE records are waiting.
     loginfo = LogInfo(log_opts)
-    logging.root.addHandler(loginfo.handler)
+    queue = Queue(maxsize=QUEUE_SIZE)
+    listener = LogQueueListener(queue, loginfo.handler, respect_handler_level=True)
+    logging.root.addHandler(LogQueueHandler(queue))
     logging.root.setLevel(loginfo.numeric_log_level)
+    listener.start()
+    # Flush everything still queued on exit
+    atexit.register(listener.stop)
     _ = logging.getLogger('es-fieldusage.cli')
     # Set up NullHandler() to handle nested elasticsearch8.trace Logger
     # instance in elasticsearch python client
     logging.getLogger('elasticsearch8.trace').addHandler(logging.NullHandler())
     if log_opts['blacklist']:
-        for bl_entry in ensure_list(log_opts['blacklist']):
+        blacklist = log_opts['blacklist']
+        for bl_entry in blacklist if isinstance(blacklist, list) else [blacklist]:
             for handler in logging.root.handlers:
                 handler.addFilter(Blacklist(bl_entry))
@@ -0,0 +1,80 @@
+"""Compile a declarative rollup mapping into an Elasticsearch transform, run server-side"""
+import logging
+import time
+from es_timeslicer.exceptions import ConfigurationException, FatalException
+from es_timeslicer.helpers.utils import get_date_histogram
+
+LOGGER = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5 # seconds
+
+def invalid(msg):
+    """Log and raise a ConfigurationException for msg"""
+    LOGGER.critical(msg)
+    raise ConfigurationException(msg)
+
+def compile_transform(mapping, request, params):
+    """
+    Return the transform (``source``, ``dest``, ``pivot``) equivalent to running the Python path
+    with the declarative mapping, which is the ``pushdown`` key of the query file:
+
+    .. code-block:: json
+
+        "pushdown": {
+          "group_by": {"host": "host.name"},
+          "metrics": {"bytes_sum": {"sum": "bytes"}, "latency": {"avg": "event.duration"}}
+        }
+
+    ``group_by`` maps output field names to the source field of a terms group. ``metrics``
+    maps output field names to ``{aggregation: source field}``. Either may use a full group
+    source or aggregation body instead of a field name. Every document is also grouped by time
+    slice, keyed by the ``field`` parameter, with the buckets aligned to the time slices.
+    """
+    if not isinstance(mapping, dict) or not mapping.get('metrics'):
+        invalid('pushdown mapping must have "metrics"')
+    # Align the buckets with the time slices, which start at end_time (the oldest date)
+    histogram = get_date_histogram(params['field'], params['increment'], params['end_time'])
+    group_by = {params['field']: {'date_histogram': histogram}}
+    for name, source in mapping.get('group_by', {}).items():
+        group_by[name] = source if isinstance(source, dict) else {'terms': {'field': source}}
+    aggregations = {}
+    for name, metric in mapping['metrics'].items():
+        if not isinstance(metric, dict) or len(metric) != 1:
+            invalid(f'pushdown metric "{name}" must be {{aggregation: field}}')
+        agg, field = next(iter(metric.items()))
+        aggregations[name] = {agg: field if isinstance(field, dict) else {'field': field}}
+    window = {'range': {params['field']: {'gte': params['end_time'], 'lt': params['start_time']}}}
+    dest = {'index': params['write_index']}
+    if params['pipeline']:
+        dest['pipeline'] = params['pipeline']
+    return {
+        'source': {
+            'index': params['read_index'],
+            'query': {'bool': {'filter': [request.get('query', {'match_all': {}}), window]}},
+        },
+        'dest': dest,
+        'pivot': {'group_by': group_by, 'aggregations': aggregations},
+    }
+
+def run_transform(client, transform_id):
+    """
+    Start the batch transform transform_id, wait for it to finish, and return its stats. The
+    transform is always deleted afterwards. The destination index is kept.
+    """
+    try:
+        client.transform.start_transform(transform_id=transform_id)
+        while True:
+            stats = client.transform.get_transform_stats(transform_id=transform_id)
+            stats = stats['transforms'][0]
+            LOGGER.debug(
+                'Transform %s: %s, %s documents indexed', transform_id, stats['state'],
+                stats['stats'].get('documents_indexed'))
+            if stats['state'] == 'failed':
+                msg = f'Transform {transform_id} failed: {stats.get("reason")}'
+                LOGGER.critical(msg)
+                raise FatalException(msg)
+            if stats['state'] == 'stopped':
+                return stats
+            time.sleep(POLL_INTERVAL)
+    finally:
+        client.transform.delete_transform(transform_id=transform_id, force=True)
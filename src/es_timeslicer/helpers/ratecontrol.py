@@ -0,0 +1,172 @@
+"""Adaptive rate and concurrency control"""
+import logging
+import threading
+import time
+from collections import deque
+from statistics import median
+
+BACKPRESSURE_STATUS = (429, 503)
+REJECTED = 'es_rejected_execution_exception'
+#: Latency samples kept per stage for the baseline
+WINDOW = 200
+
+LOGGER = logging.getLogger(__name__)
+
+def get_status(exc):
+    """Return the HTTP status code of an Elasticsearch ApiError, or None"""
+    status = getattr(exc, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+def rejected_shards(result):
+    """Return the number of shards in a search result that rejected the request"""
+    try:
+        failures = result['_shards'].get('failures', [])
+    except (KeyError, TypeError, AttributeError):
+        return 0
+    return len([f for f in failures if f.get('reason', {}).get('type') == REJECTED])
+
+class RateController:
+    """
+    AIMD (additive increase, multiplicative decrease) controller shared by the search and bulk
+    stages.
+
+    Allowed concurrency starts at 1 and grows by one slot per round of successful requests up to
+    ``max_concurrency``. Requests are unpaced until the first backpressure signal (HTTP 429/503,
+    search thread pool rejections), at which point both concurrency and request rate are cut by
+    ``decrease``. The rate then grows back by ``rate_step`` per success, never beyond
+    ``max_rate``. A latency average far above the median latency of the recent requests of a
+    stage is treated as congestion, and trims concurrency by one slot. The median, unlike the
+    best latency seen, is not fooled by a mix of fast (empty) and slow (full) time slices.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self, max_concurrency=1, max_rate=None, max_retries=10, initial_backoff=1,
+        max_backoff=600, decrease=0.5, rate_step=0.5, latency_factor=4.0):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_rate = max_rate
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.decrease = decrease
+        self.rate_step = rate_step
+        self.latency_factor = latency_factor
+        #: Attribute. The current (fractional) concurrency limit
+        self.concurrency = 1.0
+        #: Attribute. The current request rate limit in requests/second. None is unpaced.
+        self.rate = max_rate
+        self.in_flight = 0
+        self.next_start = 0.0
+        #: Attribute. The moving average latency of each stage
+        self.latency = {}
+        self.samples = {}
+        self.stats = {'requests': 0, 'backpressure': 0, 'retries': 0}
+        self.cond = threading.Condition()
+        self.started = []
+
+    def acquire(self):
+        """Block until a request slot is free and the rate limit allows another request"""
+        with self.cond:
+            while self.in_flight >= int(self.concurrency):
+                self.cond.wait()
+            self.in_flight += 1
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            wait = 0
+            if self.rate:
+                start = max(self.next_start, now)
+                wait = start - now
+                self.next_start = start + 1 / self.rate
+            self.started = [t for t in self.started if now - t < 1.0] + [now + wait]
+        if wait > 0:
+            time.sleep(wait)
+
+    def backoff(self, attempt):
+        """Sleep before retry number ``attempt``"""
+        time.sleep(min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+
+    def backpressure(self, stage, reason):
+        """Multiplicative decrease of concurrency and rate after a backpressure signal"""
+        with self.cond:
+            self.stats['backpressure'] += 1
+            self.concurrency = max(1.0, self.concurrency * self.decrease)
+            rate = self.rate if self.rate else self.observed_rate(stage)
+            self.rate = max(0.1, rate * self.decrease)
+            LOGGER.info(
+                'Backpressure from %s (%s): concurrency now %d, rate now %.2f requests/s',
+                stage, reason, int(self.concurrency), self.rate)
+
+    def call(self, func, *args, stage='search', check=None, **kwargs):
+        """
+        Call ``func(*args, **kwargs)`` under the controller, retrying with exponential backoff on
+        backpressure.
+
+        :param stage: The stage name, e.g. ``search`` or ``bulk``, for latency tracking and logs
+        :param check: Optional callable which receives the return value of ``func`` and returns
+            a reason string if the result signals backpressure, or None if it does not
+
+        :returns: The return value of ``func``. After ``max_retries``, the last result is
+            returned even if ``check`` still reports backpressure.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                if get_status(exc) not in BACKPRESSURE_STATUS or attempt == self.max_retries:
+                    raise
+                reason = f'HTTP {get_status(exc)}'
+            else:
+                reason = check(result) if check else None
+                if not reason:
+                    self.success(stage, time.monotonic() - start)
+                    return result
+                if attempt == self.max_retries:
+                    return result
+            finally:
+                self.release()
+            self.backpressure(stage, reason)
+            with self.cond:
+                self.stats['retries'] += 1
+            self.backoff(attempt)
+        return None # Not reached
+
+    def observed_rate(self, stage):
+        """
+        Estimate the current request rate from concurrency and average latency (Little's law),
+        or from the requests started in the last second if there are no latency samples yet
+        """
+        averages = [avg for avg in self.latency.values() if avg > 0]
+        if self.latency.get(stage, 0) > 0:
+            averages = [self.latency[stage]]
+        if averages:
+            return max(1.0, self.concurrency / max(averages))
+        return max(1.0, float(len(self.started)))
+
+    def release(self):
+        """Free a request slot"""
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def success(self, stage, latency):
+        """Additive increase of concurrency and rate after a successful request"""
+        with self.cond:
+            samples = self.samples.setdefault(stage, deque(maxlen=WINDOW))
+            samples.append(latency)
+            baseline = median(samples)
+            average = 0.8 * self.latency.get(stage, latency) + 0.2 * latency
+            self.latency[stage] = average
+            if average > baseline * self.latency_factor:
+                self.concurrency = max(1.0, self.concurrency - 1)
+                LOGGER.debug(
+                    'Rising %s latency (%.3fs avg, %.3fs median): concurrency now %d',
+                    stage, average, baseline, int(self.concurrency))
+            else:
+                self.concurrency = min(
+                    float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            if self.rate:
+                self.rate += self.rate_step
+                if self.max_rate:
+                    self.rate = min(self.max_rate, self.rate)
+            self.cond.notify_all()
@@ -0,0 +1,357 @@
+"""Output sinks for the documents returned by the agg_function"""
+# pylint: disable=import-outside-toplevel
+import gzip
+import json
+import logging
+import os
+import secrets
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from elasticsearch8.helpers import streaming_bulk
+from es_timeslicer.exceptions import ConfigurationException
+from es_timeslicer.helpers.ratecontrol import BACKPRESSURE_STATUS, get_status
+from es_timeslicer.helpers.utils import chunked
+
+LOGGER = logging.getLogger(__name__)
+
+MEGABYTE = 1024 * 1024
+#: Documents are consumed this many at a time, so a generator of documents is never held in
+#: memory all at once
+CHUNK_SIZE = 5000
+#: Documents per bulk request. Each bulk request goes through the rate controller separately.
+BULK_CHUNK_SIZE = 500
+
+class Sink:
+    """Base class for all sinks"""
+    def close(self):
+        """Flush any buffered documents and release resources"""
+
+    def write(self, documents):
+        """Write an iterable of documents (bulk helper actions) to the sink"""
+        raise NotImplementedError
+
+class ElasticsearchSink(Sink):
+    """
+    Bulk-write documents to Elasticsearch through the rate controller.
+
+    Documents are grouped by ``_index``, so each bulk request stays local to one index. The first
+    time an index name is seen it is resolved. Data streams only accept the ``create`` op_type,
+    and missing indices are pre-created with ``index_body`` (settings and mappings) if one was
+    provided. Otherwise, Elasticsearch auto-creates them, applying any matching index template.
+    With a ``bulkload`` :py:class:`~.BulkLoader`, missing indices are always pre-created, and
+    every target is tuned for bulk loading before the first write.
+    """
+    def __init__(self, client, ratecontrol, ignore_status=(), index_body=None, bulkload=None):
+        self.client = client
+        self.ratecontrol = ratecontrol
+        self.ignore_status = ignore_status
+        self.index_body = index_body
+        self.bulkload = bulkload
+        #: Attribute. The kind of each target seen: index, alias, data_stream, missing or unknown
+        self.targets = {}
+        self.lock = threading.Lock()
+
+    def bulk_write(self, actions, ignore_status=()):
+        """
+        Send actions to Elasticsearch, returning the actions which were rejected with a
+        backpressure status (429/503) so they can be retried
+        """
+        retry = []
+        errors = []
+        results = streaming_bulk(
+            self.client, actions, chunk_size=BULK_CHUNK_SIZE, max_retries=0,
+            raise_on_error=False, raise_on_exception=False)
+        for action, (success, item) in zip(actions, results):
+            if success:
+                continue
+            status = next(iter(item.values())).get('status')
+            if status in ignore_status:
+                continue
+            if status in BACKPRESSURE_STATUS:
+                retry.append(action)
+            else:
+                errors.append(item)
+        if errors:
+            msg = f'Bulk indexing encountered one or more errors: \n{errors}'
+            LOGGER.error(msg)
+        return retry
+
+    def create_index(self, name):
+        """
+        Create index name with the settings and mappings in index_body, and return its kind. If
+        name matches an index template for data streams, a data stream is created instead, and
+        its settings and mappings come from the template.
+        """
+        LOGGER.info('Creating index %s', name)
+        body = {
+            k: v for k, v in (self.index_body or {}).items()
+            if k in ['settings', 'mappings', 'aliases']}
+        try:
+            self.client.indices.create(index=name, **body)
+        except Exception as exc:
+            # Another process may have created it in the meantime
+            if getattr(exc, 'error', None) == 'resource_already_exists_exception':
+                return self.resolve(name)
+            if getattr(exc, 'error', None) != 'illegal_argument_exception' or \
+                    'data stream' not in str(exc):
+                raise
+            LOGGER.info('%s matches a data stream template. Creating a data stream.', name)
+            try:
+                self.client.indices.create_data_stream(name=name)
+            except Exception as exc2:
+                if getattr(exc2, 'error', None) != 'resource_already_exists_exception':
+                    raise
+            return 'data_stream'
+        return 'index'
+
+    def prepare_target(self, name):
+        """Return the kind of target name is, pre-creating it first if it is missing"""
+        with self.lock:
+            if name not in self.targets:
+                kind = self.resolve(name)
+                if kind == 'missing' and (self.index_body is not None or self.bulkload):
+                    kind = self.create_index(name)
+                if self.bulkload and kind != 'unknown':
+                    self.bulkload.tune(name, kind)
+                if kind == 'data_stream':
+                    LOGGER.info('%s is a data stream. Writing with op_type "create".', name)
+                self.targets[name] = kind
+            return self.targets[name]
+
+    def resolve(self, name):
+        """Return whether name is an index, alias, or data_stream, or is missing"""
+        try:
+            resolved = self.client.indices.resolve_index(name=name)
+        except Exception as exc:
+            if get_status(exc) == 404:
+                return 'missing'
+            LOGGER.warning('Unable to resolve write target %s: %s', name, exc)
+            return 'unknown'
+        kinds = [('data_stream', 'data_streams'), ('alias', 'aliases'), ('index', 'indices')]
+        for kind, key in kinds:
+            if resolved.get(key):
+                return kind
+        return 'missing'
+
+    def write(self, documents):
+        """Bulk-write documents, one index at a time"""
+        for chunk in chunked(documents, CHUNK_SIZE):
+            self.write_chunk(chunk)
+
+    def write_chunk(self, documents):
+        """Bulk-write a list of documents, grouped by index"""
+        groups = {}
+        for document in documents:
+            groups.setdefault(document.get('_index'), []).append(document)
+        for name, group in groups.items():
+            ignore_status = self.ignore_status
+            if name and self.prepare_target(name) == 'data_stream':
+                group = [{**doc, '_op_type': 'create'} for doc in group]
+                # An existing _id in a data stream means the document was already written
+                ignore_status = tuple(set(ignore_status) | {409})
+            self.write_group(group, ignore_status)
+
+    def write_group(self, documents, ignore_status):
+        """
+        Bulk-write documents, one bulk request of up to BULK_CHUNK_SIZE at a time, so the rate
+        controller paces every request. Rejected documents are retried.
+        """
+        def check(rejected):
+            return f'{len(rejected)} document(s) rejected' if rejected else None
+
+        for pending in chunked(documents, BULK_CHUNK_SIZE):
+            def send(pending=pending):
+                pending[:] = self.bulk_write(pending, ignore_status=ignore_status)
+                return pending
+
+            rejected = self.ratecontrol.call(send, stage='bulk', check=check)
+            if rejected:
+                LOGGER.error(
+                    '%d document(s) still rejected after %d retries', len(rejected),
+                    self.ratecontrol.max_retries)
+
+class FileSink(Sink):
+    """
+    Base class for local file sinks. Output rolls over to a new file in ``path`` once the
+    current file reaches ``max_bytes``.
+    """
+    extension = ''
+
+    def __init__(self, path, max_bytes=256 * MEGABYTE):
+        self.path = Path(path)
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+        except OSError as exc:
+            msg = f'Unable to create output path "{path}": {exc}'
+            LOGGER.critical(msg)
+            raise ConfigurationException(msg) from exc
+        self.max_bytes = max_bytes
+        # The pid and a random suffix keep jobs started in the same second from overwriting
+        # each other's files
+        started = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        self.prefix = f'timeslicer-{started}-{os.getpid()}-{secrets.token_hex(3)}'
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_filename(self):
+        """Return the name of the next output file"""
+        self.sequence += 1
+        filename = self.path / f'{self.prefix}-{self.sequence:05d}{self.extension}'
+        LOGGER.info('Writing documents to %s', filename)
+        return filename
+
+class NdjsonSink(FileSink):
+    """
+    Write documents as newline-delimited JSON, one document per line, optionally gzip
+    compressed. Each line is a bulk helper action, so files can be loaded into another cluster
+    as-is.
+    """
+    def __init__(self, path, max_bytes=256 * MEGABYTE, compress=True):
+        super().__init__(path, max_bytes=max_bytes)
+        self.compress = compress
+        self.extension = '.ndjson.gz' if compress else '.ndjson'
+        self.raw = None
+        self.stream = None
+
+    def close(self):
+        """Close the current file"""
+        with self.lock:
+            self.close_file()
+
+    def close_file(self):
+        """Close the current file, if there is one"""
+        if self.stream is not None:
+            self.stream.close()
+            if self.raw is not self.stream:
+                self.raw.close()
+        self.raw = self.stream = None
+
+    def open_file(self):
+        """Open the next file in the sequence"""
+        # pylint: disable=consider-using-with
+        self.raw = open(self.next_filename(), 'xb', buffering=MEGABYTE)
+        self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb') if self.compress else self.raw
+
+    def write(self, documents):
+        """Append documents to the current file, rolling over when it is full"""
+        for chunk in chunked(documents, CHUNK_SIZE):
+            lines = b''.join(
+                json.dumps(doc, separators=(',', ':'), default=str).encode('utf-8') + b'\n'
+                for doc in chunk)
+            with self.lock:
+                if self.stream is None:
+                    self.open_file()
+                self.stream.write(lines)
+                if self.raw.tell() >= self.max_bytes:
+                    self.close_file()
+
+class ColumnarSink(FileSink):
+    """
+    Write documents as columnar Parquet or Arrow IPC files using ``pyarrow``. Documents are
+    buffered and written ``batch_size`` at a time, each batch becoming a row group (or record
+    batch). A batch with new fields, or types which do not fit the schema of the current file,
+    starts a new file. Fields are never dropped. A field with mixed types within a batch is
+    written as strings.
+    """
+    def __init__(self, path, max_bytes=256 * MEGABYTE, fileformat='parquet', batch_size=10000):
+        try:
+            import pyarrow
+        except ImportError as exc:
+            msg = f'The {fileformat} sink requires pyarrow: pip install "es-timeslicer[parquet]"'
+            LOGGER.critical(msg)
+            raise ConfigurationException(msg) from exc
+        super().__init__(path, max_bytes=max_bytes)
+        self.pyarrow = pyarrow
+        self.fileformat = fileformat
+        self.extension = '.parquet' if fileformat == 'parquet' else '.arrow'
+        self.batch_size = batch_size
+        self.buffer = []
+        self.filename = None
+        self.schema = None
+        self.writer = None
+
+    def close(self):
+        """Flush the buffer and close the current file"""
+        with self.lock:
+            self.flush()
+            self.close_file()
+
+    def close_file(self):
+        """Close the current file, if there is one"""
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = None
+
+    def flush(self):
+        """Write the buffered documents to the current file"""
+        if not self.buffer:
+            return
+        rows, self.buffer = self.buffer, []
+        table = None
+        if self.writer is not None:
+            # from_pylist drops the keys which are not in the schema, so check for new fields
+            known = set(self.schema.names)
+            if all(known.issuperset(row) for row in rows):
+                try:
+                    table = self.pyarrow.Table.from_pylist(rows, schema=self.schema)
+                except (self.pyarrow.ArrowInvalid, self.pyarrow.ArrowTypeError):
+                    pass
+            if table is None:
+                LOGGER.info('Document schema changed. Starting a new file.')
+                self.close_file()
+        if table is None:
+            # from_pylist infers the schema from the first row alone, so build the columns from
+            # the keys of every row
+            names = list(dict.fromkeys(key for row in rows for key in row))
+            table = self.pyarrow.Table.from_pydict(
+                {name: self.get_column(name, [row.get(name) for row in rows]) for name in names})
+        if self.writer is None:
+            self.open_file(table.schema)
+        self.writer.write_table(table)
+        if self.filename.stat().st_size >= self.max_bytes:
+            self.close_file()
+
+    def get_column(self, name, values):
+        """
+        Return values as an Arrow array. If they have types which do not fit one column, e.g.
+        numbers and strings, they are written as strings, with any lists or dicts as JSON.
+        """
+        try:
+            return self.pyarrow.array(values)
+        except (self.pyarrow.ArrowInvalid, self.pyarrow.ArrowTypeError) as exc:
+            LOGGER.warning('Field "%s" has mixed types (%s). Writing it as strings.', name, exc)
+        return self.pyarrow.array([
+            value if value is None or isinstance(value, str) else json.dumps(value, default=str)
+            for value in values
+        ], type=self.pyarrow.string())
+
+    def open_file(self, schema):
+        """Open the next file in the sequence with schema"""
+        self.filename = self.next_filename()
+        self.schema = schema
+        if self.fileformat == 'parquet':
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(self.filename, schema)
+        else:
+            self.writer = self.pyarrow.ipc.new_file(str(self.filename), schema)
+
+    def write(self, documents):
+        """Buffer documents, writing a batch whenever batch_size is reached"""
+        for chunk in chunked(documents, self.batch_size):
+            with self.lock:
+                self.buffer.extend(chunk)
+                if len(self.buffer) >= self.batch_size:
+                    self.flush()
+
+def get_sink(
+    params, client=None, ratecontrol=None, ignore_status=(), index_body=None, bulkload=None):
+    """Return the sink selected by params['sink']"""
+    max_bytes = params['max_file_size'] * MEGABYTE
+    if params['sink'] == 'ndjson':
+        return NdjsonSink(params['output_path'], max_bytes=max_bytes, compress=params['compress'])
+    if params['sink'] in ['parquet', 'arrow']:
+        return ColumnarSink(params['output_path'], max_bytes=max_bytes, fileformat=params['sink'])
+    return ElasticsearchSink(
+        client, ratecontrol, ignore_status=ignore_status, index_body=index_body,
+        bulkload=bulkload)
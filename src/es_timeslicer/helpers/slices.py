@@ -0,0 +1,197 @@
+"""Generate the time slice boundaries of a window, all at once, as integer epoch arrays"""
+import logging
+import re
+from array import array
+from calendar import monthrange
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from es_timeslicer.exceptions import ConfigurationException
+
+LOGGER = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+DAY = 86400000
+MONDAY = 4 * DAY # 1970-01-05, the first Monday after the epoch
+#: Fixed interval units, in milliseconds
+FIXED_UNITS = {'ms': 1, 's': 1000, 'm': 60000, 'h': 3600000}
+#: Calendar interval units, in (months, days). Their length depends on the date and time zone.
+CALENDAR_UNITS = {'d': (0, 1), 'w': (0, 7), 'M': (1, 0), 'q': (3, 0), 'y': (12, 0)}
+INTERVAL = re.compile(r'^(\d+)(ms|s|m|h|d|w|M|q|y)$')
+
+def invalid(msg):
+    """Log and raise a ConfigurationException for msg"""
+    LOGGER.critical(msg)
+    raise ConfigurationException(msg)
+
+def parse_interval(interval):
+    """
+    Return interval as a ``(count, unit)`` tuple. An int, or a string of digits alone, is a number
+    of minutes, as with ``increment``.
+    """
+    if isinstance(interval, int) or str(interval).isdigit():
+        interval = f'{interval}m'
+    match = INTERVAL.match(str(interval))
+    if not match or int(match.group(1)) < 1:
+        invalid(f'Invalid interval "{interval}". Use e.g. 15m, 1h, 1d, 1w, 1M, 1q or 1y.')
+    return int(match.group(1)), match.group(2)
+
+def to_millis(value):
+    """Return an aware datetime as integer epoch milliseconds"""
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+class SlicePlan:
+    """
+    Every time slice of the window from ``start`` (oldest) to ``end``, with ``n + 1`` slice
+    boundaries kept in an ``array('q')`` of epoch milliseconds.
+
+    :param start: The oldest ISO8601 date (or datetime) of the window. Naive dates are UTC.
+    :param end: The newest ISO8601 date (or datetime) of the window, exclusive
+    :param interval: Minutes as an int, or a count and unit, e.g. ``15m``, ``1h``, ``1d``. Days,
+        weeks, months, quarters and years are calendar units, so a day is 23 or 25 hours long
+        across a DST change in ``tz``.
+    :param tz: Time zone name for calendar units, alignment and output. Defaults to the time
+        zone of start, or UTC.
+    :param align: Put the boundaries on interval boundaries (midnight, the first of the month,
+        the top of the hour...) rather than counting from start. The first and last slices are
+        clipped to the window.
+    :param reverse: Iterate over the newest slice first
+
+    Slices are given as ISO8601 strings in the form of the input: naive if start was naive,
+    otherwise with the UTC offset of ``tz``.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, start, end, interval, tz=None, align=False, reverse=False):
+        start, end = [datetime.fromisoformat(v) if isinstance(v, str) else v for v in [start, end]]
+        self.naive = start.tzinfo is None
+        try:
+            self.tz = ZoneInfo(tz) if tz else (start.tzinfo or timezone.utc)
+        except (ZoneInfoNotFoundError, ValueError) as exc:
+            invalid(f'Unknown time zone "{tz}": {exc}')
+        # Naive dates are UTC, as in Elasticsearch
+        start, end = [v if v.tzinfo else v.replace(tzinfo=timezone.utc) for v in [start, end]]
+        # Elasticsearch date fields have millisecond resolution, as do the boundaries, but the
+        # window itself is given exactly as it was, e.g. for date_nanos fields
+        self.start, self.end = self.isodate(start), self.isodate(end)
+        self.count, self.unit = parse_interval(interval)
+        self.reverse = reverse
+        low, high = to_millis(start), to_millis(end)
+        boundaries = array('q')
+        if high > low:
+            if self.unit in FIXED_UNITS:
+                boundaries = self.fixed(low, high, align, self.count * FIXED_UNITS[self.unit])
+            elif self.unit in ['d', 'w'] and self.count == 1 and isinstance(self.tz, timezone):
+                # Without DST, days and weeks are fixed intervals, which are much faster
+                step, origin = (DAY, 0) if self.unit == 'd' else (7 * DAY, MONDAY)
+                boundaries = self.fixed(low, high, align, step, origin=origin)
+            else:
+                boundaries = self.calendar(start.astimezone(self.tz), low, high, align)
+            boundaries.append(high)
+        #: Attribute. The slice boundaries in epoch milliseconds, oldest first
+        self.boundaries = boundaries
+        #: Attribute. The indices of the slices in this plan (or partition of a plan)
+        self.indices = range(max(len(boundaries) - 1, 0))
+
+    def __getitem__(self, index):
+        """Return slice number index of this plan as a (begin, end) tuple of epoch milliseconds"""
+        position = self.indices[index]
+        return self.boundaries[position], self.boundaries[position + 1]
+
+    def __iter__(self):
+        """Yield (begin, end) ISO8601 string tuples, in plan order"""
+        return self.isoslices()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def calendar(self, local, low, high, align):
+        """Return the boundaries of calendar intervals, stepping in local (wall clock) time"""
+        months, days = CALENDAR_UNITS[self.unit]
+        months, days = months * self.count, days * self.count
+        if align:
+            local = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            if self.unit == 'w':
+                local -= timedelta(days=local.weekday())
+            elif months:
+                # e.g. quarters start in January, April, July and October
+                period = min(months, 12)
+                local = local.replace(day=1, month=(local.month - 1) // period * period + 1)
+        wall = local.replace(tzinfo=None)
+        boundaries = array('q', [low])
+        step = 1
+        while True:
+            if months:
+                total = (wall.month - 1) + months * step
+                year, month = wall.year + total // 12, total % 12 + 1
+                # Clamp to the end of the month, e.g. Jan 31 + 1 month is Feb 28 (or 29)
+                moment = wall.replace(
+                    year=year, month=month, day=min(wall.day, monthrange(year, month)[1]))
+            else:
+                moment = wall + timedelta(days=days * step)
+            value = to_millis(moment.replace(tzinfo=self.tz))
+            if value >= high:
+                break
+            if value > low:
+                boundaries.append(value)
+            step += 1
+        return boundaries
+
+    def fixed(self, low, high, align, step, origin=0):
+        """Return the boundaries of intervals of step milliseconds"""
+        first = low
+        if align:
+            # The first multiple of step after origin in local time, e.g. the top of the hour
+            # in a +05:30 time zone
+            offset = self.utcoffset(low) - origin
+            first = -(-(low + offset) // step) * step - offset
+        boundaries = array('q', [low] if first > low else [])
+        boundaries.extend(range(first, high, step))
+        return boundaries
+
+    def isodate(self, moment):
+        """Return an aware datetime as an ISO8601 string in the form of the input dates"""
+        if self.naive and self.tz is timezone.utc:
+            return moment.replace(tzinfo=None).isoformat()
+        return moment.astimezone(self.tz).isoformat()
+
+    def isoformat(self, millis):
+        """Return epoch milliseconds as an ISO8601 string in the form of the input dates"""
+        return self.isodate(EPOCH + timedelta(milliseconds=millis))
+
+    def isoslice(self, position):
+        """
+        Return slice number position of the whole plan as a (begin, end) ISO8601 string tuple.
+        The window's own start and end are given as they were, with any sub-millisecond digits.
+        """
+        last = len(self.boundaries) - 2
+        return (
+            self.start if position == 0 else self.isoformat(self.boundaries[position]),
+            self.end if position == last else self.isoformat(self.boundaries[position + 1]))
+
+    def isoslices(self):
+        """Yield (begin, end) ISO8601 string tuples, in plan order"""
+        indices = reversed(self.indices) if self.reverse else self.indices
+        for position in indices:
+            yield self.isoslice(position)
+
+    def partition(self, parts):
+        """
+        Return the plan split into up to parts contiguous plans of (nearly) equal length, e.g. one
+        per parallel executor. The partitions share the boundaries array.
+        """
+        size, extra = divmod(len(self.indices), parts)
+        partitions = []
+        first = 0
+        for part in range(parts):
+            last = first + size + (1 if part < extra else 0)
+            if last > first:
+                partition = object.__new__(SlicePlan)
+                partition.__dict__.update(self.__dict__)
+                partition.indices = self.indices[first:last]
+                partitions.append(partition)
+            first = last
+        return partitions[::-1] if self.reverse else partitions
+
+    def utcoffset(self, millis):
+        """Return the UTC offset of tz at epoch milliseconds, in milliseconds"""
+        moment = (EPOCH + timedelta(milliseconds=millis)).astimezone(self.tz)
+        return moment.utcoffset() // timedelta(milliseconds=1)
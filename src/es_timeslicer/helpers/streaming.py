@@ -0,0 +1,178 @@
+"""Incremental parsing of search responses, for time slices too large to decode in one piece"""
+# pylint: disable=import-outside-toplevel
+import gzip
+import io
+import json
+import logging
+import time
+from tempfile import SpooledTemporaryFile
+from urllib.parse import quote, urlencode
+from es_timeslicer.exceptions import ConfigurationException
+
+LOGGER = logging.getLogger(__name__)
+
+#: Response statuses which do not mark a node dead, as in elastic_transport
+NOT_DEAD_NODE_STATUS = (400, 401, 402, 403, 404, 409)
+#: Response bytes kept in memory before the response body is spooled to disk
+SPOOL_SIZE = 8 * 1024 * 1024
+#: Response bytes read at a time
+READ_SIZE = 64 * 1024
+
+def get_ijson():
+    """Return the ijson module, which is an optional dependency"""
+    try:
+        import ijson
+    except ImportError as exc:
+        msg = 'The stream mode requires ijson: pip install "es-timeslicer[stream]"'
+        LOGGER.critical(msg)
+        raise ConfigurationException(msg) from exc
+    return ijson
+
+def get_header(raw):
+    """
+    Return the top-level keys of the raw search response which come before ``aggregations``
+    (``took``, ``_shards``, ``hits``...). Parsing stops there, so the aggregations are not read.
+    """
+    ijson = get_ijson()
+    header = {}
+    key = builder = None
+    for prefix, event, value in ijson.parse(rewind(raw), use_float=True):
+        if prefix == '':
+            if builder is not None:
+                header[key] = builder.value
+                builder = None
+            if event == 'map_key':
+                if value == 'aggregations':
+                    break
+                key, builder = value, ijson.ObjectBuilder()
+        elif builder is not None:
+            builder.event(event, value)
+    return header
+
+def iter_buckets(raw, name):
+    """Yield the buckets of the top-level aggregation name in the raw response, one at a time"""
+    ijson = get_ijson()
+    yield from ijson.items(rewind(raw), f'aggregations.{name}.buckets.item', use_float=True)
+
+def perform_request(node, target, headers, body, request_timeout):
+    """
+    Send a POST request to node, and return its response meta and body. The body is read in
+    chunks into a temporary file, which stays in memory up to SPOOL_SIZE bytes and moves to
+    disk beyond that, so a large response is never held in memory whole. Errors are raised as
+    the elastic_transport node raises them. Nodes other than the default urllib3 node read the
+    whole body.
+    """
+    # pylint: disable=too-many-locals
+    import urllib3
+    from elastic_transport import ApiResponseMeta, ConnectionError as TransportConnectionError
+    from elastic_transport import ConnectionTimeout, HttpHeaders, TlsError
+    from elastic_transport.client_utils import DEFAULT
+    spool = SpooledTemporaryFile(max_size=SPOOL_SIZE) # pylint: disable=consider-using-with
+    if not hasattr(node, 'pool'):
+        meta, raw = node.perform_request(
+            'POST', target, headers=headers, body=body, request_timeout=request_timeout)
+        spool.write(raw)
+        return meta, spool
+    request_headers = node.headers.copy()
+    request_headers.update(headers)
+    if node.config.http_compress:
+        body = gzip.compress(body)
+        request_headers['content-encoding'] = 'gzip'
+    kwargs = {} if request_timeout is DEFAULT else {'timeout': request_timeout}
+    start = time.time()
+    try:
+        response = node.pool.urlopen(
+            'POST', f'{node.path_prefix}{target}', body=body, headers=request_headers,
+            retries=urllib3.Retry(False), preload_content=False, **kwargs)
+        try:
+            for chunk in response.stream(READ_SIZE, decode_content=True):
+                spool.write(chunk)
+        finally:
+            response.release_conn()
+    except urllib3.exceptions.NewConnectionError as exc:
+        # Checked first, as it is a subclass of ConnectTimeoutError
+        spool.close()
+        raise TransportConnectionError(str(exc), errors=(exc,)) from exc
+    except (urllib3.exceptions.ConnectTimeoutError, urllib3.exceptions.ReadTimeoutError) as exc:
+        spool.close()
+        raise ConnectionTimeout('Connection timed out during request', errors=(exc,)) from exc
+    except urllib3.exceptions.SSLError as exc:
+        spool.close()
+        raise TlsError(str(exc), errors=(exc,)) from exc
+    except (urllib3.exceptions.HTTPError, OSError) as exc:
+        spool.close()
+        raise TransportConnectionError(str(exc), errors=(exc,)) from exc
+    meta = ApiResponseMeta(
+        node=node.config, duration=time.time() - start, http_version='1.1',
+        status=response.status, headers=HttpHeaders(response.headers))
+    return meta, spool
+
+def rewind(raw):
+    """Return the raw response, bytes or a file, as a file read from the start"""
+    if isinstance(raw, bytes):
+        return io.BytesIO(raw)
+    raw.seek(0)
+    return raw
+
+def search_raw(client, index, body, params=None):
+    """
+    Send a search request, and return the undecoded response body, in a file (see
+    :py:func:`perform_request`). The Elasticsearch client always decodes the whole response, so
+    the request is sent to a node from its pool directly, with the headers, request timeout and
+    retries of the client. As in the transport, nodes which fail to connect are marked dead, so
+    the retries go to other nodes. params are added to the URL, e.g.
+    ``{'ignore_unavailable': True}``.
+    """
+    # The client has no public accessors for its per-request settings
+    # pylint: disable=protected-access
+    from elastic_transport import ConnectionError as TransportConnectionError
+    from elastic_transport import ConnectionTimeout, HttpHeaders
+    from elastic_transport.client_utils import resolve_default
+    from elasticsearch8 import ApiError
+    transport = client.transport
+    max_retries = resolve_default(client._max_retries, transport.max_retries)
+    retry_on_timeout = resolve_default(client._retry_on_timeout, transport.retry_on_timeout)
+    retry_on_status = resolve_default(client._retry_on_status, transport.retry_on_status)
+    headers = HttpHeaders(client._headers)
+    headers.update({'accept': 'application/json', 'content-type': 'application/json'})
+    target = f'/{quote(index, safe=",*")}/_search'
+    if params:
+        query = {k: str(v).lower() if isinstance(v, bool) else v for k, v in params.items()}
+        target = f'{target}?{urlencode(query)}'
+    data = json.dumps(body).encode('utf-8')
+    for attempt in range(max_retries + 1):
+        node = transport.node_pool.get()
+        try:
+            meta, raw = perform_request(node, target, headers, data, client._request_timeout)
+        except (ConnectionTimeout, TransportConnectionError) as exc:
+            transport.node_pool.mark_dead(node)
+            retry = retry_on_timeout or not isinstance(exc, ConnectionTimeout)
+            if not retry or attempt >= max_retries:
+                raise
+            LOGGER.warning(
+                'Retrying search after failure (attempt %d of %d): %s', attempt + 1, max_retries,
+                exc)
+            continue
+        if 200 <= meta.status < 300 or meta.status in NOT_DEAD_NODE_STATUS:
+            transport.node_pool.mark_live(node)
+        else:
+            transport.node_pool.mark_dead(node)
+        if meta.status not in retry_on_status or attempt >= max_retries:
+            break
+        raw.close()
+        LOGGER.warning(
+            'Retrying search after status %d (attempt %d of %d)', meta.status, attempt + 1,
+            max_retries)
+    if not 200 <= meta.status < 300:
+        message = rewind(raw).read(1000).decode('utf-8', errors='replace')
+        raw.close()
+        raise ApiError(message, meta=meta, body=message)
+    return raw
+
+def streamed_result(raw, name):
+    """
+    Return the result handed to the agg_function in stream mode: the response header (see
+    :py:func:`get_header`), with ``buckets`` an iterator over the buckets of aggregation name.
+    The response is read sequentially, so the header is parsed before the buckets are iterated.
+    """
+    return {**get_header(raw), 'buckets': iter_buckets(raw, name)}
@@ -0,0 +1,91 @@
+"""Send each time slice search only to the indices whose time range overlaps it"""
+import logging
+from es_timeslicer.helpers.utils import epoch_millis
+
+LOGGER = logging.getLogger(__name__)
+
+#: Comma-separated index lists longer than this fall back to read_index, keeping the request
+#: line well below the 4kb default of http.max_initial_line_length
+MAX_TARGETS_LENGTH = 3000
+MAX_INDICES = 10000
+
+def get_filtered_aliases(client, index):
+    """Return the names of the aliases behind index (a pattern, alias or list) which filter"""
+    resolved = client.indices.resolve_index(name=index)
+    aliases = [alias['name'] for alias in resolved.get('aliases', [])]
+    if not aliases:
+        return []
+    filtered = set()
+    for body in client.indices.get_alias(name=','.join(aliases)).values():
+        for name, alias in body.get('aliases', {}).items():
+            if alias.get('filter'):
+                filtered.add(name)
+    return sorted(filtered)
+
+def get_index_ranges(client, index, field, begin, end):
+    """
+    Return a list of ``(name, min, max)`` tuples, in epoch milliseconds, with the range of field
+    in each concrete index behind index (a pattern, alias or data stream), between the ISO8601
+    dates begin and end. Indices without documents in that window are left out.
+
+    The newest index may still be receiving documents, so its max is open-ended (infinity).
+
+    Returns None if the list may be incomplete: the search timed out or failed on some shards,
+    or more than MAX_INDICES indices have documents. Leaving an index out would lose its
+    documents, so every slice must then be searched on all of index. Also returns None if index
+    has an alias with a filter, which a search of the concrete indices would not apply.
+    """
+    filtered = get_filtered_aliases(client, index)
+    if filtered:
+        LOGGER.warning(
+            'Alias(es) %s have a filter, which only applies when searching the alias. Not '
+            'pruning indices.', ', '.join(filtered))
+        return None
+    result = client.search(
+        index=index, size=0,
+        query={'range': {field: {'gte': begin, 'lt': end}}},
+        aggs={
+            'indices': {
+                'terms': {'field': '_index', 'size': MAX_INDICES},
+                'aggs': {'min': {'min': {'field': field}}, 'max': {'max': {'field': field}}},
+            }
+        },
+    )
+    failed = result.get('_shards', {}).get('failed', 0)
+    if result.get('timed_out') or failed:
+        LOGGER.warning(
+            'Index range search timed out or failed on %s shard(s). Searching all indices.',
+            failed)
+        return None
+    if result['aggregations']['indices'].get('sum_other_doc_count'):
+        LOGGER.warning('More than %d indices have documents. Searching all indices.', MAX_INDICES)
+        return None
+    ranges = sorted(
+        (bucket['key'], bucket['min']['value'], bucket['max']['value'])
+        for bucket in result['aggregations']['indices']['buckets']
+        if bucket['min']['value'] is not None
+    )
+    if ranges:
+        newest = max(range(len(ranges)), key=lambda i: ranges[i][2])
+        name, low, _ = ranges[newest]
+        ranges[newest] = (name, low, float('inf'))
+    for name, low, high in ranges:
+        LOGGER.debug('Index %s: %s from %s to %s', name, field, low, high)
+    return ranges
+
+def get_targets(ranges, begin, end, default):
+    """
+    Return the comma-separated names of the indices in ranges which overlap the time slice from
+    begin (inclusive) to end (exclusive), or default if the list would be too long.
+
+    If no index overlaps, the slice has no documents, and a single index is searched so the
+    agg_function still gets a response of the usual shape.
+    """
+    if not ranges:
+        return default
+    low, high = epoch_millis(begin), epoch_millis(end)
+    names = [name for name, imin, imax in ranges if imin < high and imax >= low]
+    targets = ','.join(names or [ranges[0][0]])
+    if len(targets) > MAX_TARGETS_LENGTH:
+        return default
+    return targets
@@ -1,14 +1,21 @@
 """Utility helper functions"""
 
 import logging
-from json import load
+import re
+from datetime import datetime, timezone
+from hashlib import sha1
+from itertools import islice
+from json import dumps, load
 from pathlib import Path
+from string import Formatter
 import click
 from es_timeslicer.defaults import click_options
 from es_timeslicer.exceptions import ConfigurationException, FatalException
 
 LOGGER = logging.getLogger(__name__)
 NOPE = 'DONOTUSE'
+#: The fields of a write_index template
+TEMPLATE_FIELDS = ('slice_start', 'slice_end')
 
 def cli_opts(value, onoff=None, override=None):
     """
@@ -33,12 +40,100 @@ def cli_opts(value, onoff=None, override=None):
     # return (argval,), override_hidden(retval, show=show)
     return (argval,), override_settings(click_options()[value], override)
 
+def chunked(iterable, size):
+    """Yield lists of up to size items from iterable, without reading ahead any further"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def epoch_millis(isodate):
+    """Return ISO8601 isodate in epoch milliseconds. Naive dates are UTC, as in Elasticsearch."""
+    value = datetime.fromisoformat(isodate)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp() * 1000
+
+def get_date_histogram(field, increment, start):
+    """
+    Return a ``date_histogram`` of field with one bucket per time slice of increment minutes,
+    offset so the bucket keys line up with the time slices starting at ISO8601 date start
+    """
+    histogram = {'field': field, 'fixed_interval': f'{increment}m'}
+    offset = int(epoch_millis(start) % (increment * 60000))
+    if offset:
+        histogram['offset'] = f'{offset}ms'
+    return histogram
+
+def get_fingerprint(data):
+    """Return a stable SHA-1 hex digest of the JSON-serializable ``data``"""
+    return sha1(
+        dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    ).hexdigest()
+
+def get_hits(result):
+    """Return the total hit count of a search result, or 0 if it is not tracked"""
+    try:
+        total = result['hits']['total']
+    except (KeyError, TypeError):
+        return 0
+    return total['value'] if isinstance(total, dict) else total
+
+def get_value(data, path):
+    """
+    Return the value found at ``path`` in ``data``.
+
+    An exact key match is tried first, as field names like ``url.path`` are valid keys. Otherwise
+    ``path`` is treated as dot notation, e.g. ``url.path`` -> ``data['url']['path']``
+    """
+    if path in data:
+        return data[path]
+    value = data
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            msg = f'Key path "{path}" not found in document'
+            LOGGER.critical(msg)
+            raise ConfigurationException(msg)
+        value = value[key]
+    return value
+
+def human_size(nbytes):
+    """Return nbytes as a human readable string, e.g. ``1.5 GB``"""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if nbytes < 1024 or unit == 'TB':
+            break
+        nbytes /= 1024
+    return f'{nbytes:.1f} {unit}'
+
+def human_time(seconds):
+    """Return seconds as a human readable string, e.g. ``2d 3h 4m 5s``"""
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    parts = [f'{v}{u}' for v, u in [(days, 'd'), (hours, 'h'), (minutes, 'm')] if v]
+    return ' '.join(parts + [f'{seconds}s'])
+
 def is_docker():
     """Check if we're running in a docker container"""
     cgroup = Path('/proc/self/cgroup')
     return Path('/.dockerenv').is_file() or (
         cgroup.is_file() and 'docker' in cgroup.read_text(encoding='utf-8'))
 
+def is_template(write_index):
+    """
+    Return whether write_index is a template of ``{slice_start}`` and ``{slice_end}`` fields.
+    Anything else, such as the date math name ``<rollup-{now/d}>``, is an index name.
+    """
+    try:
+        fields = [field for _, field, _, _ in Formatter().parse(write_index) if field is not None]
+    except ValueError:
+        return False
+    return bool(fields) and all(
+        re.split(r'[.\[]', field)[0] in TEMPLATE_FIELDS for field in fields)
+
 def option_wrapper():
     """Return the click decorator passthrough function"""
     return passthrough(click.option)
@@ -47,6 +142,8 @@ def override_settings(data, new_data):
     """Override keys in data with values matching in new_data"""
     if not isinstance(new_data, dict):
         raise ConfigurationException('new_data must be of type dict')
+    # Copy, so overrides for one command do not leak into the shared CLI_OPTIONS
+    data = dict(data)
     for key in list(new_data.keys()):
         if key in data:
             data[key] = new_data[key]
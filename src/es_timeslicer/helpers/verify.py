@@ -0,0 +1,95 @@
+"""Compare the per-slice document counts of the read and write indices, and re-run plans"""
+import json
+import logging
+import re
+from bisect import bisect_left
+from datetime import datetime
+from es_timeslicer.exceptions import ConfigurationException
+from es_timeslicer.helpers.utils import is_template
+
+LOGGER = logging.getLogger(__name__)
+
+#: Time slices counted per search, well below the search.max_buckets default of 65536
+MAX_BUCKETS = 5000
+
+def compare(read_counts, write_counts, exact=False):
+    """
+    Yield ``(key, read, write, status)`` for every slice which is ``missing`` (documents read,
+    none written), ``unexpected`` (documents written, none read), or, if exact, ``mismatch``
+    (the counts differ)
+    """
+    for key in sorted(set(read_counts) | set(write_counts)):
+        read, write = read_counts.get(key, 0), write_counts.get(key, 0)
+        if read and not write:
+            status = 'missing'
+        elif write and not read:
+            status = 'unexpected'
+        elif exact and read != write:
+            status = 'mismatch'
+        else:
+            continue
+        yield key, read, write, status
+
+def count_slices(client, index, field, plan, query=None, count_field=None):
+    """
+    Return a dict of the document count of each non-empty time slice of the
+    :py:class:`~.SlicePlan` plan in index, keyed by slice start in epoch milliseconds. With
+    count_field, the count is the sum of that field (e.g. the ``doc_count`` of rollup documents).
+
+    Each search counts up to MAX_BUCKETS slices with a single ``date_range`` aggregation on the
+    slice boundaries, so calendar intervals, time zones and alignment count exactly the slices
+    the run uses.
+    """
+    boundaries = plan.boundaries
+    counts = {}
+    for first in range(0, len(plan), MAX_BUCKETS):
+        last = min(first + MAX_BUCKETS, len(plan))
+        ranges = [
+            {'from': boundaries[i], 'to': boundaries[i + 1]} for i in range(first, last)]
+        aggs = {'slices': {'date_range': {'field': field, 'ranges': ranges}}}
+        if count_field:
+            aggs['slices']['aggs'] = {'count': {'sum': {'field': count_field}}}
+        window = {'range': {field: {
+            'gte': boundaries[first], 'lt': boundaries[last], 'format': 'epoch_millis'}}}
+        result = client.search(
+            index=index, size=0, aggs=aggs,
+            query={'bool': {'filter': [window] + ([query] if query else [])}})
+        for bucket in result['aggregations']['slices']['buckets']:
+            if bucket['doc_count']:
+                count = bucket['count']['value'] if count_field else bucket['doc_count']
+                counts[int(bucket['from'])] = count
+    return counts
+
+def get_pattern(write_index):
+    """
+    Return write_index as an index pattern, e.g. rollup-{slice_start:%Y.%m} -> rollup-*. A
+    write_index which is not a template is returned as it is.
+    """
+    if not is_template(write_index):
+        return write_index
+    return re.sub(r'\{[^}]*\}', '*', write_index)
+
+def get_slice(plan, key):
+    """
+    Return the (begin, end) ISO8601 dates of the time slice of plan starting at key (epoch
+    milliseconds), exactly as the run itself gives them
+    """
+    return plan.isoslice(bisect_left(plan.boundaries, key))
+
+def read_plan(filename):
+    """
+    Return the list of (begin, end) time slices in a re-run plan, as written by the ``verify``
+    command: one JSON object with ``begin`` and ``end`` keys per line
+    """
+    try:
+        with open(filename, 'r', encoding='utf8') as planfile:
+            entries = [json.loads(line) for line in planfile if line.strip()]
+        plan = [(entry['begin'], entry['end']) for entry in entries]
+        for begin, end in plan:
+            datetime.fromisoformat(begin)
+            datetime.fromisoformat(end)
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        msg = f'Unable to read plan "{filename}": {exc}'
+        LOGGER.critical(msg)
+        raise ConfigurationException(msg) from exc
+    return sorted(plan)
@@ -1,15 +1,27 @@
 """Main app definition"""
 # pylint: disable=broad-exception-caught, exec-used
 import logging
-import sys
 import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from copy import deepcopy
+from itertools import count
 from datetime import datetime as pydate
-from datetime import timedelta
+from itertools import chain
 from click import secho
-from elasticsearch8.helpers import bulk, BulkIndexError
-from es_client.helpers.utils import prune_nones
-from es_timeslicer.helpers.client import get_args, get_client
+from es_timeslicer.helpers.client import client_factory
+from es_timeslicer.helpers.logging import LazyJson
 from es_timeslicer.helpers import utils
+from es_timeslicer.helpers.archive import ArchiveWriter
+from es_timeslicer.helpers.bulkload import BulkLoader
+from es_timeslicer.helpers.pushdown import compile_transform, run_transform
+from es_timeslicer.helpers.ratecontrol import RateController, rejected_shards
+from es_timeslicer.helpers.sinks import get_sink
+from es_timeslicer.helpers.slices import SlicePlan
+from es_timeslicer.helpers.streaming import get_header, get_ijson, search_raw, streamed_result
+from es_timeslicer.helpers.targets import get_index_ranges, get_targets
+from es_timeslicer.helpers.verify import read_plan
 from es_timeslicer.exceptions import ConfigurationException, FatalException, MissingArgument
 
 ARGS = [
@@ -17,6 +29,10 @@ ARGS = [
     'agg_function', 'query_file', 'trace'
 ]
 
+PREVIEW_DOCS = 5
+DEFAULT_POOL_SIZE = 10 # The elastic_transport default connections_per_node
+MAX_POOL_SIZE = 100 # The most connections_per_node es_client accepts
+
 def load_function(filename, global_vars=None, local_vars=None):
     """Assume that filename contains only 1 function"""
     if not global_vars:
@@ -33,18 +49,9 @@ class TimeSlicer:
     def __init__(self, client_params, params):
         self.logger = logging.getLogger(__name__)
         self.logger.debug('Initializing TimeSlicer class object')
-        try:
-            client_args, other_args = get_args(client_params)
-            self.client = get_client(configdict={
-                'elasticsearch': {
-                    'client': prune_nones(client_args.asdict()),
-                    'other_settings': prune_nones(other_args.asdict())
-                }
-            })
-        except Exception as exc:
-            self.logger.critical('Unable to establish client connection: %s', exc)
-            raise FatalException from exc
-
+        self.client_params = client_params
+        self._client = None
+        self.client_lock = threading.Lock()
         for key in ARGS:
             if not key in params:
                 msg = f'"{key}" not in parameters'
@@ -53,13 +60,175 @@ class TimeSlicer:
         self.params = params
         self.end_dt = self.verify_date(params['start_time'])
         self.range_start_dt = self.verify_date(params['end_time'])
+        self.slice_plan = SlicePlan(
+            self.range_start_dt, self.end_dt, params.get('interval') or params['increment'],
+            tz=params.get('time_zone'), align=params.get('align'),
+            reverse=params.get('newest_first'))
         self.trace = params['trace']
+        self.trace_counter = count()
+        # Fail early on a bad write_index template rather than at the first time slice
+        self.get_write_index(params['start_time'], params['end_time'])
+        self.fingerprint = None
+        self.ratecontrol = RateController(
+            max_concurrency=params['max_concurrency'], max_rate=params['max_rate'])
+        self.sink = None
+        self.archive = None
+        self.bulkload = None
+        self.index_ranges = None
+        self.stream_agg = None
+        self.plan = read_plan(params['plan']) if params.get('plan') else None
+        self.stats = {'slices': 0, 'documents': 0}
+        self.stats_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The Elasticsearch client, which connects on first use"""
+        with self.client_lock:
+            if self._client is None:
+                try:
+                    self._client = client_factory(
+                        self.client_params, connections_per_node=self.pool_size())
+                except Exception as exc:
+                    self.logger.critical('Unable to establish client connection: %s', exc)
+                    raise FatalException from exc
+            return self._client
 
-    def bulk_generator(self, data):
+    def bulk_generator(self, data, begin=None, end=None):
         """Python generator to feed the bulk input"""
         for entry in data:
+            if self.params['id_key']:
+                entry = self.stamp_id(entry, begin, end)
             yield entry
 
+    def count_documents(self, documents):
+        """Pass documents through, adding their number to the run stats"""
+        count = 0
+        for document in documents:
+            count += 1
+            yield document
+        with self.stats_lock:
+            self.stats['documents'] += count
+
+    def estimate(self, agg_function, total, fetch):
+        """
+        Dry-run: fetch and transform a sample of the total time slices, spread across the whole
+        window, without writing anything, and extrapolate the cost of the full run. fetch(pick)
+        returns the (begin, end, search result) of time slice number pick, e.g. by searching, or
+        from a recorded archive.
+        """
+        count = min(total, self.params['sample_slices'])
+        if count == 0:
+            secho('DRY-RUN: No time slices in the window. Exiting.', bold=True)
+            return
+        # Evenly spaced, always including the first and the last slice
+        picks = sorted({round(i * (total - 1) / max(count - 1, 1)) for i in range(count)})
+        samples = []
+        preview = None
+        for pick in picks:
+            start = time.monotonic()
+            begin, end, result = fetch(pick)
+            documents = list(self.bulk_generator(self.run_agg_function(
+                result, agg_function, begin, end, trace=self.sample_trace()) or [], begin, end))
+            elapsed = time.monotonic() - start
+            if documents and preview is None:
+                preview = documents
+            samples.append({
+                'begin': begin, 'end': end, 'seconds': elapsed, 'documents': len(documents),
+                'bytes': sum(len(json.dumps(doc, default=str)) for doc in documents),
+                'hits': utils.get_hits(result),
+            })
+        if preview:
+            secho('DRY-RUN: DOCUMENT PREVIEW:', bold=True)
+            secho(f'{json.dumps(preview[:PREVIEW_DOCS], indent=2, default=str)}', bold=True)
+            if len(preview) > PREVIEW_DOCS:
+                secho(f'... and {len(preview) - PREVIEW_DOCS} more document(s)', bold=True)
+        concurrency = self.ratecontrol.max_concurrency
+        factor = total / len(samples)
+        seconds = sum(s['seconds'] for s in samples) * factor / concurrency
+        secho(f'DRY-RUN: ESTIMATE ({len(samples)} of {total} time slices sampled):', bold=True)
+        secho(f'  Time slices:  {total}')
+        secho(f'  Documents:    ~{round(sum(s["documents"] for s in samples) * factor)}')
+        secho(f'  Output size:  ~{utils.human_size(sum(s["bytes"] for s in samples) * factor)}')
+        secho(
+            f'  Wall-clock:   ~{utils.human_time(seconds)} at max_concurrency {concurrency} '
+            f'(writes not included)')
+        secho('  Heaviest sampled time slices:')
+        for sample in sorted(samples, key=lambda s: (s['hits'], s['documents']), reverse=True)[:3]:
+            secho(
+                f'    {sample["begin"]} - {sample["end"]}: {sample["hits"]} hits, '
+                f'{sample["documents"]} documents, {sample["seconds"]:.3f}s')
+        secho('DRY-RUN: COMPLETED.', bold=True)
+
+    def finish(self, start):
+        """
+        Close the sink, restore any settings changed by bulk-load mode, and log the run summary.
+        This runs even if the run ends with an exception.
+        """
+        try:
+            self.sink.close()
+        finally:
+            if self.bulkload:
+                self.bulkload.restore()
+            self.summary(time.monotonic() - start)
+
+    def get_agg_function(self):
+        """Load the agg_function from its file"""
+        self.logger.debug('Loading agg function from file.')
+        try:
+            gvars = {'__builtins__': {'float': float}}
+            lvars = {}
+            return load_function(
+                self.params['agg_function'], global_vars=gvars, local_vars=lvars)
+        except Exception as exc:
+            self.logger.error('Unable to load agg_function: %s', self.params['agg_function'])
+            self.logger.critical('Error: %s', exc)
+            raise FatalException from exc
+
+    def get_doc_id(self, document, begin, end):
+        """
+        Return a deterministic _id for document, which is a hash of the time slice bounds, the
+        query fingerprint, and the values found at each of the ``id_key`` paths. The bounds are
+        hashed as epoch milliseconds, so the same instants give the same _id in any UTC offset.
+        """
+        keyvals = [utils.get_value(document, path) for path in self.params['id_key']]
+        bounds = [int(utils.epoch_millis(begin)), int(utils.epoch_millis(end))]
+        return utils.get_fingerprint([*bounds, self.fingerprint, keyvals])
+
+    def get_index_body(self):
+        """Read the settings and mappings for new write indices from the index_settings file"""
+        try:
+            with open(self.params['index_settings'], 'r', encoding='utf8') as f:
+                body = json.load(f)
+        except (OSError, ValueError) as exc:
+            msg = f'Unable to read index_settings file: {exc}'
+            self.logger.critical(msg)
+            raise ConfigurationException(msg) from exc
+        if not isinstance(body, dict) or not set(body) & {'settings', 'mappings', 'aliases'}:
+            msg = 'index_settings file must have "settings", "mappings", and/or "aliases" keys'
+            self.logger.critical(msg)
+            raise ConfigurationException(msg)
+        return body
+
+    def get_index_ranges(self):
+        """
+        Plan the run: look up the range of the time field in each index behind read_index, so
+        each time slice can be searched on only the indices it overlaps
+        """
+        begin, end = self.range_start_dt.isoformat(), self.end_dt.isoformat()
+        try:
+            ranges = self.ratecontrol.call(
+                get_index_ranges, self.client, self.params['read_index'], self.params['field'],
+                begin, end, stage='search')
+        except Exception as exc:
+            self.logger.warning('Unable to look up index time ranges, searching all: %s', exc)
+            return None
+        if ranges is None:
+            return None
+        self.logger.info(
+            '%d index(es) in %s have documents between %s and %s',
+            len(ranges), self.params['read_index'], begin, end)
+        return ranges
+
     def get_query(self):
         """Get the raw query from the query_file"""
         try:
@@ -80,82 +249,382 @@ class TimeSlicer:
             }
         }
 
-    def get_rangevals(self):
-        """Add increment to self.range_start_dt to set the rangevals"""
-        begin = self.range_start_dt.isoformat()
-        delta = timedelta(minutes=self.params['increment'])
-        end = (self.range_start_dt + delta).isoformat()
-        if pydate.fromisoformat(end) > self.end_dt:
-            end = self.end_dt.isoformat()
-        return begin, end
+    def get_sink(self):
+        """Return the configured sink. Only the elasticsearch sink needs the client."""
+        client = None
+        index_body = None
+        if self.params['sink'] == 'elasticsearch':
+            client = self.client
+            if self.params.get('index_settings'):
+                index_body = self.get_index_body()
+            if self.params.get('bulk_load_mode'):
+                self.bulkload = BulkLoader(client, force_merge=self.params.get('force_merge'))
+        return get_sink(
+            self.params, client=client, ratecontrol=self.ratecontrol,
+            ignore_status=self.ignore_status(), index_body=index_body, bulkload=self.bulkload)
+
+    def get_result(self, response):
+        """
+        Return the search result handed to the agg_function: the response itself, or in stream
+        mode a result which parses the buckets out of the raw response as they are iterated
+        """
+        if self.stream_agg is None:
+            return response
+        return streamed_result(response, self.stream_agg)
+
+    def get_slice(self, position):
+        """Return time slice number position (oldest first) as a (begin, end) tuple"""
+        if self.plan is not None:
+            return self.plan[position]
+        return self.slice_plan.isoslice(self.slice_plan.indices[position])
+
+    def get_slice_count(self):
+        """Return the number of time slices in the run"""
+        return len(self.plan) if self.plan is not None else len(self.slice_plan)
+
+    def get_slices(self):
+        """
+        Yield the (begin, end) tuple of each time slice in the slice plan. With a re-run plan,
+        only the time slices in the re-run plan are yielded.
+        """
+        if self.plan is not None:
+            yield from self.plan
+            return
+        yield from self.slice_plan
+
+    def get_stream_agg(self, request):
+        """Return the name of the single top-level aggregation whose buckets are streamed"""
+        get_ijson()
+        aggs = request.get('aggs', request.get('aggregations')) or {}
+        if len(aggs) != 1:
+            msg = 'Stream mode requires exactly one top-level aggregation in the query'
+            self.logger.critical(msg)
+            raise ConfigurationException(msg)
+        return next(iter(aggs))
+
+    def get_write_index(self, begin, end):
+        """
+        Return the write index for the time slice from begin to end. A write_index containing
+        ``{slice_start}`` or ``{slice_end}`` fields is a template, formatted with the slice
+        bounds as datetimes, e.g. ``rollup-{slice_start:%Y.%m.%d}``.
+        """
+        template = self.params['write_index']
+        if not utils.is_template(template):
+            return template
+        try:
+            return template.format(
+                slice_start=pydate.fromisoformat(begin), slice_end=pydate.fromisoformat(end))
+        except (KeyError, IndexError, ValueError) as exc:
+            msg = f'Invalid write_index template "{template}": {exc}'
+            self.logger.critical(msg)
+            raise ConfigurationException(msg) from exc
+
+    def handle_result(self, result, agg_function, begin, end, trace=False):
+        """Run the agg_function on the search result, and write the documents it returns"""
+        documents = iter(
+            self.run_agg_function(result, agg_function, begin, end, trace=trace) or [])
+        with self.stats_lock:
+            self.stats['slices'] += 1
+        # The agg_function may return a list or a generator. Peek, rather than materialize it.
+        first = next(documents, None)
+        if first is not None:
+            documents = chain([first], documents)
+            self.logger.debug('Writing documents to %s sink', self.params['sink'])
+            try:
+                self.write_documents(self.count_documents(documents), begin, end)
+            except Exception as exc:
+                self.logger.error('Exception encountered during write to sink: %s', exc)
+                raise FatalException from exc
+        else:
+            self.logger.debug('No documents found in this time slice. Continuing...')
+
+    def ignore_status(self):
+        """
+        With op_type ``create``, documents with an existing _id fail with a 409 conflict, which
+        means the document was already written. These are not errors.
+        """
+        if self.params['id_key'] and self.params['op_type'] == 'create':
+            return (409,)
+        return ()
 
     def loop_query(self):
         """Loop the query"""
         request = self.get_query()
-        self.logger.debug('Loading agg function from file.')
+        self.fingerprint = utils.get_fingerprint(request)
+        agg_function = self.get_agg_function()
+        if self.params.get('pushdown') and self.pushdown(request):
+            return
+        if self.params.get('stream'):
+            self.stream_agg = self.get_stream_agg(request)
+        if self.params.get('prune_indices'):
+            self.index_ranges = self.get_index_ranges()
+        if self.params['dry_run']:
+            if self.params['record']:
+                self.logger.warning('Dry run: not recording to %s', self.params['record'])
+
+            def fetch(pick):
+                begin, end = self.get_slice(pick)
+                self.logger.debug('Sampling timeslice: BEGIN: %s, END: %s', begin, end)
+                response = self.search(self.update_request(
+                    deepcopy(request), self.get_range_filter(begin, end)), begin, end)
+                return begin, end, self.get_result(response)
+
+            self.estimate(agg_function, self.get_slice_count(), fetch)
+            return
+        if self.params['record']:
+            self.archive = ArchiveWriter(self.params['record'], {
+                'params': {key: self.params[key] for key in ARGS},
+                'fingerprint': self.fingerprint,
+                'query': request,
+            })
+        start = time.monotonic()
+        self.sink = self.get_sink()
         try:
-            gvars = {'__builtins__': {'float': float}}
-            lvars = {}
-            agg_function = load_function(
-                self.params['agg_function'], global_vars=gvars, local_vars=lvars)
+            if self.ratecontrol.max_concurrency == 1:
+                for begin, end in self.get_slices():
+                    self.process_slice(request, agg_function, begin, end)
+            else:
+                self.run_concurrent(request, agg_function)
+        finally:
+            self.finish(start)
+            if self.archive:
+                self.archive.close()
+
+    def pool_size(self):
+        """
+        Return the connection pool size per node. Unless set explicitly, the client default is
+        kept until max_concurrency outgrows it, up to MAX_POOL_SIZE.
+        """
+        if self.params.get('connections_per_node'):
+            return self.params['connections_per_node']
+        if self.ratecontrol.max_concurrency > DEFAULT_POOL_SIZE:
+            return min(self.ratecontrol.max_concurrency, MAX_POOL_SIZE)
+        return None
+
+    def process_slice(self, request, agg_function, begin, end):
+        """Search, transform, and write a single time slice"""
+        self.logger.debug('Timeslice: BEGIN: %s, END: %s', begin, end)
+        range_filter = self.get_range_filter(begin, end)
+        request = self.update_request(request, range_filter)
+        trace = self.sample_trace()
+        if trace:
+            self.logger.debug('TRACE: REQUEST: \n%s', LazyJson(request))
+        response = self.search(request, begin, end)
+        try:
+            if self.archive:
+                self.archive.add(begin, end, response if self.stream_agg else dict(response))
+            self.handle_result(self.get_result(response), agg_function, begin, end, trace=trace)
+        finally:
+            if self.stream_agg:
+                # The raw response body is a temporary file
+                response.close()
+
+    def pushdown(self, request):
+        """
+        Run the declarative ``pushdown`` mapping in the query file server-side, as a batch
+        transform, with no per-slice round trip through Python. Returns False if the agg_function
+        has to be used instead.
+        """
+        reason = None
+        if 'pushdown' not in request:
+            reason = 'the query file has no "pushdown" mapping'
+        elif self.params['sink'] != 'elasticsearch':
+            reason = f'the {self.params["sink"]} sink is not supported'
+        elif self.params['record']:
+            reason = '--record needs every search response'
+        elif self.plan is not None:
+            reason = '--plan selects individual time slices'
+        elif any(self.params.get(key) for key in ['interval', 'time_zone', 'align']):
+            reason = 'only --increment time slices are supported'
+        elif utils.is_template(self.params['write_index']):
+            reason = 'write_index templates are not supported'
+        elif self.params.get('id_key') or self.params.get('op_type', 'index') != 'index':
+            reason = 'the transform sets its own document _ids, ignoring --id_key and --op_type'
+        elif self.params.get('bulk_load_mode') or self.params.get('index_settings'):
+            reason = 'the transform creates the destination index itself'
+        elif self.params.get('prune_indices') or self.params.get('stream'):
+            reason = '--prune_indices and --stream apply to the per-slice searches'
+        if reason:
+            self.logger.warning('Not pushing down: %s. Using the agg_function.', reason)
+            return False
+        body = compile_transform(request['pushdown'], request, self.params)
+        if self.trace:
+            self.logger.debug('TRACE: TRANSFORM: \n%s', LazyJson(body))
+        if self.params['dry_run']:
+            preview = self.client.transform.preview_transform(**body)['preview']
+            secho('DRY-RUN: PUSHDOWN DOCUMENT PREVIEW:', bold=True)
+            secho(f'{json.dumps(preview[:PREVIEW_DOCS], indent=2, default=str)}', bold=True)
+            secho('DRY-RUN: COMPLETED.', bold=True)
+            return True
+        transform_id = f'es-timeslicer-{utils.get_fingerprint(body)[:16]}'
+        try:
+            self.client.transform.put_transform(
+                transform_id=transform_id, description='es-timeslicer pushdown', **body)
         except Exception as exc:
-            self.logger.error('Unable to load agg_function: %s', self.params['agg_function'])
-            self.logger.critical('Error: %s', exc)
+            self.logger.warning('Unable to create transform: %s. Using the agg_function.', exc)
+            return False
+        self.logger.info('Running transform %s', transform_id)
+        start = time.monotonic()
+        try:
+            stats = run_transform(self.client, transform_id)
+        except Exception as exc:
+            self.logger.critical('Transform %s did not complete: %s', transform_id, exc)
             raise FatalException from exc
-        while self.range_start_dt < self.end_dt:
-            begin, end = self.get_rangevals()
-            self.logger.debug('Timeslice: BEGIN: %s, END: %s', begin, end)
-            range_filter = self.get_range_filter(begin, end)
-            request = self.update_request(request, range_filter)
-            if self.trace:
-                msg = f'TRACE: REQUEST: \n{json.dumps(request, indent=2)}'
-                self.logger.debug(msg)
-            reqkeys = list(request.keys())
-            agg = None
-            if 'aggs' in reqkeys:
-                agg = request['aggs']
-            elif 'aggregations' in reqkeys:
-                agg = request['aggregations']
-            result = self.client.search(
-                index=self.params['read_index'],
-                aggs=agg, query=request['query'],
-                size=request['size']
-            )
-            if self.trace:
-                msg = f'TRACE: RESULT: \n{json.dumps(dict(result), indent=2)}'
-                self.logger.debug(msg)
+        self.stats['slices'] = self.get_slice_count()
+        self.stats['documents'] = stats['stats'].get('documents_indexed', 0)
+        self.summary(time.monotonic() - start)
+        return True
+
+    def replay(self, reader):
+        """
+        Feed the search results recorded in the archive reader through the agg_function and the
+        sink. No searches are sent to Elasticsearch.
+        """
+        agg_function = self.get_agg_function()
+        # Use the recorded query fingerprint so deterministic _ids match the original run
+        self.fingerprint = reader.metadata['fingerprint']
+        if self.params.get('stream'):
+            self.stream_agg = self.get_stream_agg(reader.metadata['query'])
+        raw = self.stream_agg is not None
+        if self.params['dry_run']:
+            # A dry run writes nothing, so it needs no sink, and no cluster
+
+            def fetch(pick):
+                entry = reader.entries[pick]
+                response = reader.read(entry, raw=raw)
+                return entry['begin'], entry['end'], self.get_result(response)
+
             try:
-                documents = agg_function(
-                                result, self.params['write_index'], self.params['pipeline'])
-            except Exception as exc:
-                msg = f'Error executing function "{self.params["agg_function"]}": Error: {exc}'
-                self.logger.critical(msg)
-                raise FatalException from exc
-            if documents:
-                if self.params['dry_run']:
-                    secho('DRY-RUN: DOCUMENT PREVIEW:', bold=True)
-                    secho(f'{json.dumps(documents, indent=2)}', bold=True)
-                    secho('DRY-RUN: COMPLETED. Exiting.', bold=True)
-                    sys.exit(0)
-                else:
-                    self.logger.debug('Bulk-writing documents to %s', self.params['write_index'])
-                    try:
-                        bulk(
-                            self.client,
-                            self.bulk_generator(documents),
-                            max_retries=10,
-                            initial_backoff=1
-                        )
-                    except BulkIndexError as bie:
-                        msg = f'Bulk indexing encountered one or more errors: \n{bie.errors}'
-                        self.logger.error(msg)
-                    except Exception as exc:
-                        self.logger.error('Exception encountered during bulk write to ES: %s', exc)
-                        raise FatalException from exc
-            else:
-                self.logger.debug('No documents found in this time slice. Continuing...')
-            # After successful iteration, update range_start_dt:
-            self.range_start_dt = pydate.fromisoformat(end)
+                self.estimate(agg_function, len(reader), fetch)
+            finally:
+                reader.close()
+            return
+        start = time.monotonic()
+        self.sink = self.get_sink()
+        self.logger.info('Replaying %d time slices from %s', len(reader), reader.path)
+        try:
+            for begin, end, response in reader.slices(raw=raw):
+                self.logger.debug('Timeslice: BEGIN: %s, END: %s', begin, end)
+                self.handle_result(
+                    self.get_result(response), agg_function, begin, end,
+                    trace=self.sample_trace())
+        finally:
+            self.finish(start)
+            reader.close()
+
+    def run_agg_function(self, result, agg_function, begin, end, trace=False):
+        """
+        Return the documents the agg_function makes of the search result. The agg_function gets
+        the write index of this time slice.
+        """
+        if trace:
+            self.logger.debug('TRACE: RESULT: \n%s', LazyJson(dict(result)))
+        try:
+            return agg_function(
+                result, self.get_write_index(begin, end), self.params['pipeline'])
+        except Exception as exc:
+            msg = f'Error executing function "{self.params["agg_function"]}": Error: {exc}'
+            self.logger.critical(msg)
+            raise FatalException from exc
+
+    def run_concurrent(self, request, agg_function):
+        """Process time slices in a thread pool of max_concurrency workers"""
+        # Keep a bounded number of slices queued. The rate controller decides how many of them
+        # are actually in flight at any moment.
+        window = 2 * self.ratecontrol.max_concurrency
+        with ThreadPoolExecutor(max_workers=self.ratecontrol.max_concurrency) as executor:
+            pending = set()
+            for begin, end in self.get_slices():
+                if len(pending) >= window:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(
+                    self.process_slice, deepcopy(request), agg_function, begin, end))
+            for future in pending:
+                future.result()
+
+    def sample_trace(self):
+        """
+        Return whether to trace the next time slice. With trace on and DEBUG logging, every
+        trace_every-th time slice is traced.
+        """
+        if not self.trace or not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        return next(self.trace_counter) % (self.params.get('trace_every') or 1) == 0
+
+    def search(self, request, begin=None, end=None):
+        """
+        Execute the search through the rate controller, retrying if the cluster pushes back with
+        a 429/503 response or search thread pool rejections. With index ranges planned, only the
+        indices overlapping the time slice from begin to end are searched.
+        """
+        index = self.params['read_index']
+        params = {}
+        if self.index_ranges is not None and begin is not None:
+            index = get_targets(self.index_ranges, begin, end, index)
+            if index != self.params['read_index']:
+                # A concrete index deleted during the run (e.g. by ILM) is skipped, as it would
+                # be when searching a pattern
+                params['ignore_unavailable'] = True
+            self.logger.debug('Searching %s', index)
+        reqkeys = list(request.keys())
+        agg = None
+        if 'aggs' in reqkeys:
+            agg = request['aggs']
+        elif 'aggregations' in reqkeys:
+            agg = request['aggregations']
+
+        def check(result):
+            if self.stream_agg is not None:
+                result = get_header(result)
+            rejected = rejected_shards(result)
+            return f'{rejected} shard(s) rejected the search' if rejected else None
+
+        if self.stream_agg is not None:
+            # The raw response body, to be parsed incrementally
+            body = {'aggs': agg, 'query': request['query'], 'size': request['size']}
+            result = self.ratecontrol.call(
+                search_raw, self.client, index, body, params=params, stage='search', check=check)
+        else:
+            result = self.ratecontrol.call(
+                self.client.search, stage='search', check=check,
+                index=index, aggs=agg, query=request['query'],
+                size=request['size'], **params
+            )
+        incomplete = check(result)
+        if incomplete:
+            self.logger.warning('Search results are incomplete: %s', incomplete)
+        return result
+
+    def stamp_id(self, document, begin, end):
+        """
+        Add a deterministic _id and the _op_type to document, so re-processing a time slice
+        overwrites (or skips) documents instead of duplicating them. An _id or _op_type already
+        set by the agg_function is left untouched.
+        """
+        if '_id' not in document:
+            document['_id'] = self.get_doc_id(document, begin, end)
+        if '_op_type' not in document:
+            document['_op_type'] = self.params['op_type']
+        return document
+
+    def summary(self, elapsed):
+        """Log the run summary"""
+        stats = self.ratecontrol.stats
+        lines = [
+            f'Time slices:  {self.stats["slices"]}',
+            f'Documents:    {self.stats["documents"]}',
+            f'Wall-clock:   {utils.human_time(elapsed)}',
+            (
+                f'Requests:     {stats["requests"]} ({stats["backpressure"]} backpressure, '
+                f'{stats["retries"]} retries)'
+            ),
+        ]
+        if self.bulkload:
+            lines.append('Bulk-load mode:')
+            lines.extend(f'  {line}' for line in self.bulkload.summary())
+        self.logger.info('Run summary:\n  %s', '\n  '.join(lines))
 
     def update_request(self, request, range_filter):
         """Return an updated request that has the desired date range filter"""
@@ -196,3 +665,7 @@ class TimeSlicer:
             self.logger.critical('"%s" is not valid ISO8601. Exiting...', date)
             raise ConfigurationException from exc
         return value
+
+    def write_documents(self, documents, begin, end):
+        """Write documents from the time slice to the sink"""
+        self.sink.write(self.bulk_generator(documents, begin, end))
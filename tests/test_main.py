@@ -0,0 +1,56 @@
+"""Tests for the deterministic document _id"""
+import pytest
+from es_timeslicer.main import TimeSlicer
+
+def make(**params):
+    """Return a TimeSlicer with a fingerprint, which does not connect to a cluster"""
+    defaults = {
+        'read_index': 'logs', 'write_index': 'rollup', 'pipeline': None, 'field': '@timestamp',
+        'start_time': '2024-01-02T00:00:00', 'end_time': '2024-01-01T00:00:00',
+        'increment': '1h', 'agg_function': None, 'query_file': None, 'trace': False,
+        'id_key': ('host',), 'op_type': 'index', 'max_concurrency': 1, 'max_rate': None,
+    }
+    slicer = TimeSlicer({}, {**defaults, **params})
+    slicer.fingerprint = 'query'
+    return slicer
+
+@pytest.fixture(name='slicer')
+def fixture_slicer():
+    """A TimeSlicer keyed on host"""
+    return make()
+
+def test_doc_id_offsets(slicer):
+    """The same instants give the same _id in any UTC offset"""
+    utc = slicer.get_doc_id({'host': 'a'}, '2024-01-01T10:00:00+00:00', '2024-01-01T11:00:00Z')
+    berlin = slicer.get_doc_id(
+        {'host': 'a'}, '2024-01-01T11:00:00+01:00', '2024-01-01T12:00:00+01:00')
+    delhi = slicer.get_doc_id(
+        {'host': 'a'}, '2024-01-01T15:30:00+05:30', '2024-01-01T16:30:00+05:30')
+    assert utc == berlin == delhi
+
+def test_doc_id_differs(slicer):
+    """The _id changes with the time slice, the id_key values, and the query"""
+    begin, end = '2024-01-01T10:00:00+00:00', '2024-01-01T11:00:00+00:00'
+    doc_id = slicer.get_doc_id({'host': 'a'}, begin, end)
+    assert doc_id != slicer.get_doc_id({'host': 'b'}, begin, end)
+    assert doc_id != slicer.get_doc_id({'host': 'a'}, begin, '2024-01-01T12:00:00+00:00')
+    slicer.fingerprint = 'other query'
+    assert doc_id != slicer.get_doc_id({'host': 'a'}, begin, end)
+
+def test_stamp_id(slicer):
+    """stamp_id adds the _id and the op_type"""
+    document = slicer.stamp_id({'host': 'a'}, '2024-01-01T10:00:00', '2024-01-01T11:00:00')
+    assert document['_id'] == slicer.get_doc_id(
+        {'host': 'a'}, '2024-01-01T10:00:00', '2024-01-01T11:00:00')
+    assert document['_op_type'] == 'index'
+
+def test_stamp_id_keeps_agg_function_values():
+    """An _id or _op_type set by the agg_function is kept"""
+    slicer = make(op_type='create')
+    document = slicer.stamp_id(
+        {'host': 'a', '_id': 'mine', '_op_type': 'delete'},
+        '2024-01-01T10:00:00', '2024-01-01T11:00:00')
+    assert (document['_id'], document['_op_type']) == ('mine', 'delete')
+    document = slicer.stamp_id(
+        {'host': 'a', '_id': 'mine'}, '2024-01-01T10:00:00', '2024-01-01T11:00:00')
+    assert (document['_id'], document['_op_type']) == ('mine', 'create')
@@ -0,0 +1,131 @@
+"""Tests for the AIMD rate controller"""
+import pytest
+from es_timeslicer.helpers import ratecontrol
+from es_timeslicer.helpers.ratecontrol import RateController
+
+class Clock:
+    """A stand-in for the time module, whose sleep advances a fake clock"""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        """Return the fake time"""
+        return self.now
+
+    def sleep(self, seconds):
+        """Record the sleep, and advance the fake time"""
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class Busy(Exception):
+    """An error with an HTTP status, as raised by the Elasticsearch client"""
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+@pytest.fixture(name='clock')
+def fixture_clock(monkeypatch):
+    """Replace the time module used by the rate controller with a fake clock"""
+    clock = Clock()
+    monkeypatch.setattr(ratecontrol, 'time', clock)
+    return clock
+
+def replies(*results):
+    """Return a function which returns (or raises) each of results in turn"""
+    results = list(results)
+    def func():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return func
+
+def test_additive_increase(clock):
+    """Concurrency grows by about one slot per round of successes, up to max_concurrency"""
+    # pylint: disable=unused-argument
+    control = RateController(max_concurrency=4)
+    control.success('search', 0.1)
+    assert control.concurrency == 2
+    for _ in range(3):
+        control.success('search', 0.1)
+    assert int(control.concurrency) == 3
+    for _ in range(20):
+        control.success('search', 0.1)
+    assert control.concurrency == 4
+
+def test_multiplicative_decrease(clock):
+    """Backpressure halves concurrency and rate, and successes grow the rate back"""
+    # pylint: disable=unused-argument
+    control = RateController(max_concurrency=8, max_rate=10)
+    control.concurrency = 8.0
+    control.backpressure('search', 'HTTP 429')
+    assert (control.concurrency, control.rate) == (4.0, 5.0)
+    control.success('search', 0.1)
+    assert control.rate == 5.5
+    control.rate = 9.8
+    control.success('search', 0.1)
+    assert control.rate == 10
+    assert control.stats['backpressure'] == 1
+
+def test_decrease_from_unpaced(clock):
+    """Unpaced, backpressure sets the rate from concurrency and latency (Little's law)"""
+    # pylint: disable=unused-argument
+    control = RateController(max_concurrency=8)
+    assert control.rate is None
+    control.concurrency = 4.0
+    control.latency['search'] = 0.5
+    control.backpressure('search', 'HTTP 429')
+    # Concurrency is halved to 2 first, so 2 / 0.5s = 4 requests/s, halved
+    assert control.rate == 2.0
+
+def test_latency_trims_concurrency(clock):
+    """A latency average far above the median trims concurrency by one slot"""
+    # pylint: disable=unused-argument
+    control = RateController(max_concurrency=8)
+    control.concurrency = 5.0
+    for _ in range(10):
+        control.success('search', 0.1)
+    concurrency = control.concurrency
+    control.success('search', 10.0)
+    assert control.concurrency == concurrency - 1
+
+def test_rate_pacing(clock):
+    """Requests are spaced 1/rate seconds apart"""
+    control = RateController(max_concurrency=4, max_rate=2)
+    control.rate = 2
+    for _ in range(3):
+        control.acquire()
+        control.release()
+    assert clock.sleeps == [0.5, 0.5]
+
+def test_call_retries_backpressure(clock):
+    """A 429 is retried after a backoff, and the result of the retry returned"""
+    control = RateController(max_retries=3, initial_backoff=1)
+    assert control.call(replies(Busy(429), Busy(503), 'ok')) == 'ok'
+    assert control.stats['retries'] == 2
+    assert control.stats['backpressure'] == 2
+    assert [s for s in clock.sleeps if s >= 1] == [1, 2]
+    assert control.in_flight == 0
+
+def test_call_raises_other_errors(clock):
+    """Other errors are raised at once, and so is the last backpressure error"""
+    # pylint: disable=unused-argument
+    control = RateController(max_retries=3)
+    with pytest.raises(Busy):
+        control.call(replies(Busy(400), 'ok'))
+    assert control.stats['retries'] == 0
+    control = RateController(max_retries=1)
+    with pytest.raises(Busy):
+        control.call(replies(Busy(429), Busy(429), 'ok'))
+    assert control.stats['retries'] == 1
+    assert control.in_flight == 0
+
+def test_call_check(clock):
+    """A result which check reports is retried, and the last one returned after max_retries"""
+    # pylint: disable=unused-argument
+    control = RateController(max_retries=2)
+    check = lambda result: 'rejected' if result == 'partial' else None
+    assert control.call(replies('partial', 'full'), check=check) == 'full'
+    assert control.call(replies('partial', 'partial', 'partial'), check=check) == 'partial'
+    assert control.stats['retries'] == 3
@@ -0,0 +1,31 @@
+"""Tests for the columnar sink"""
+import pytest
+from es_timeslicer.helpers.sinks import ColumnarSink
+
+pyarrow = pytest.importorskip('pyarrow')
+pytest.importorskip('pyarrow.parquet')
+
+def read(path):
+    """Return the rows of every Parquet file in path, in file order"""
+    return [
+        row for filename in sorted(path.glob('*.parquet'))
+        for row in pyarrow.parquet.read_table(filename).to_pylist()
+    ]
+
+def test_mixed_types_in_batch(tmp_path, caplog):
+    """A field with numbers and strings in one batch is written as strings, with a warning"""
+    sink = ColumnarSink(tmp_path, batch_size=10)
+    sink.write([{'k': 1, 'v': 1}, {'k': 'two', 'v': 2}, {'k': [3], 'v': 3}, {'v': 4}])
+    sink.close()
+    assert read(tmp_path) == [
+        {'k': '1', 'v': 1}, {'k': 'two', 'v': 2}, {'k': '[3]', 'v': 3}, {'k': None, 'v': 4}]
+    assert 'Field "k" has mixed types' in caplog.text
+
+def test_schema_change_starts_new_file(tmp_path):
+    """A batch with a new field starts a new file, and keeps the field"""
+    sink = ColumnarSink(tmp_path, batch_size=2)
+    sink.write([{'k': 1}, {'k': 2}, {'k': 3, 'new': 'x'}, {'k': 4}])
+    sink.close()
+    assert len(list(tmp_path.glob('*.parquet'))) == 2
+    assert read(tmp_path) == [
+        {'k': 1}, {'k': 2}, {'k': 3, 'new': 'x'}, {'k': 4, 'new': None}]
@@ -0,0 +1,145 @@
+"""Tests for the time slice plan"""
+import time
+import pytest
+from es_timeslicer.exceptions import ConfigurationException
+from es_timeslicer.helpers.slices import SlicePlan, parse_interval
+
+HOUR = 3600000
+#: Seconds allowed to build a plan of a million one-minute slices. It takes about 0.15s.
+BUILD_BUDGET = 1.0
+
+def lengths(plan):
+    """Return the length of each slice of plan, in hours"""
+    return [(end - begin) / HOUR for begin, end in (plan[i] for i in range(len(plan)))]
+
+def test_increment_minutes():
+    """An int is minutes, and naive dates give naive slices"""
+    plan = SlicePlan('2024-01-01T00:00:00', '2024-01-01T01:00:00', 20)
+    assert list(plan) == [
+        ('2024-01-01T00:00:00', '2024-01-01T00:20:00'),
+        ('2024-01-01T00:20:00', '2024-01-01T00:40:00'),
+        ('2024-01-01T00:40:00', '2024-01-01T01:00:00'),
+    ]
+
+def test_last_slice_is_clipped():
+    """The last slice ends at the end of the window"""
+    plan = SlicePlan('2024-01-01T00:00:00', '2024-01-01T00:50:00', '20m')
+    assert list(plan)[-1] == ('2024-01-01T00:40:00', '2024-01-01T00:50:00')
+
+def test_empty_window():
+    """A window which ends before it starts has no slices"""
+    assert not list(SlicePlan('2024-01-02T00:00:00', '2024-01-01T00:00:00', '1h'))
+
+@pytest.mark.parametrize('interval', ['0m', '5x', '-1h', 'h'])
+def test_invalid_interval(interval):
+    """Bad intervals are configuration errors"""
+    with pytest.raises(ConfigurationException):
+        parse_interval(interval)
+
+def test_unknown_time_zone():
+    """An unknown time zone is a configuration error"""
+    with pytest.raises(ConfigurationException):
+        SlicePlan('2024-01-01T00:00:00', '2024-01-02T00:00:00', '1d', tz='Mars/Olympus_Mons')
+
+def test_dst_spring_forward():
+    """The day the clocks go forward is 23 hours long"""
+    plan = SlicePlan(
+        '2024-03-30T00:00:00+01:00', '2024-04-01T00:00:00+02:00', '1d', tz='Europe/Berlin')
+    assert list(plan) == [
+        ('2024-03-30T00:00:00+01:00', '2024-03-31T00:00:00+01:00'),
+        ('2024-03-31T00:00:00+01:00', '2024-04-01T00:00:00+02:00'),
+    ]
+    assert lengths(plan) == [24, 23]
+
+def test_dst_fall_back():
+    """The day the clocks go back is 25 hours long"""
+    plan = SlicePlan(
+        '2024-10-26T00:00:00+02:00', '2024-10-28T00:00:00+01:00', '1d', tz='Europe/Berlin')
+    assert [end for _, end in plan] == ['2024-10-27T00:00:00+02:00', '2024-10-28T00:00:00+01:00']
+    assert lengths(plan) == [24, 25]
+
+def test_fixed_hours_across_dst():
+    """Fixed units ignore DST: every slice is an hour, even as the UTC offset changes"""
+    plan = SlicePlan(
+        '2024-03-31T01:00:00+01:00', '2024-03-31T04:00:00+02:00', '1h', tz='Europe/Berlin')
+    assert lengths(plan) == [1, 1]
+    assert [begin for begin, _ in plan] == [
+        '2024-03-31T01:00:00+01:00', '2024-03-31T03:00:00+02:00']
+
+def test_month_end_clamping():
+    """Months starting on the 31st end on the last day of shorter months"""
+    plan = SlicePlan('2024-01-31T00:00:00', '2024-05-01T00:00:00', '1M')
+    assert [end for _, end in plan] == [
+        '2024-02-29T00:00:00', '2024-03-31T00:00:00', '2024-04-30T00:00:00',
+        '2024-05-01T00:00:00',
+    ]
+
+def test_align_hours():
+    """Aligned hours start at the top of the hour, clipping the first and last slice"""
+    plan = SlicePlan('2024-01-01T10:17:00', '2024-01-01T12:30:00', '1h', align=True)
+    assert list(plan) == [
+        ('2024-01-01T10:17:00', '2024-01-01T11:00:00'),
+        ('2024-01-01T11:00:00', '2024-01-01T12:00:00'),
+        ('2024-01-01T12:00:00', '2024-01-01T12:30:00'),
+    ]
+
+def test_align_half_hour_offset():
+    """Alignment is in local time, e.g. the top of the hour in +05:30"""
+    plan = SlicePlan('2024-01-01T10:17:00+05:30', '2024-01-01T12:00:00+05:30', '1h', align=True)
+    assert [begin for begin, _ in plan] == [
+        '2024-01-01T10:17:00+05:30', '2024-01-01T11:00:00+05:30']
+
+def test_align_weeks():
+    """Aligned weeks start on Monday"""
+    plan = SlicePlan('2024-01-03T00:00:00', '2024-01-20T00:00:00', '1w', align=True)
+    assert [begin for begin, _ in plan] == [
+        '2024-01-03T00:00:00', '2024-01-08T00:00:00', '2024-01-15T00:00:00']
+
+def test_align_quarters():
+    """Aligned quarters start in January, April, July and October"""
+    plan = SlicePlan('2024-02-15T00:00:00', '2024-12-01T00:00:00', '1q', align=True)
+    assert [begin for begin, _ in plan] == [
+        '2024-02-15T00:00:00', '2024-04-01T00:00:00', '2024-07-01T00:00:00',
+        '2024-10-01T00:00:00',
+    ]
+
+def test_reverse():
+    """reverse yields the newest slice first"""
+    forward = list(SlicePlan('2024-01-01T00:00:00', '2024-01-01T03:00:00', '1h'))
+    reverse = list(SlicePlan('2024-01-01T00:00:00', '2024-01-01T03:00:00', '1h', reverse=True))
+    assert reverse == forward[::-1]
+
+def test_partition():
+    """Partitions are contiguous, of nearly equal length, and cover the plan"""
+    plan = SlicePlan('2024-01-01T00:00:00', '2024-01-01T10:00:00', '1h')
+    parts = plan.partition(3)
+    assert [len(part) for part in parts] == [4, 3, 3]
+    assert [s for part in parts for s in part] == list(plan)
+    assert len(plan.partition(20)) == 10
+
+def test_partition_reverse():
+    """Partitions of a reversed plan come newest first, and so do their slices"""
+    plan = SlicePlan('2024-01-01T00:00:00', '2024-01-01T10:00:00', '1h', reverse=True)
+    assert [s for part in plan.partition(3) for s in part] == list(plan)
+
+def test_sub_millisecond_window():
+    """The window itself is kept as given, with its microseconds"""
+    plan = SlicePlan('2024-01-01T00:00:00.123456', '2024-01-01T00:30:00.654321', '15m')
+    slices = list(plan)
+    assert slices[0][0] == '2024-01-01T00:00:00.123456'
+    assert slices[-1][1] == '2024-01-01T00:30:00.654321'
+    assert slices[1][0] == '2024-01-01T00:15:00.123000'
+
+def test_build_time():
+    """A million one-minute slices, in a DST time zone, are built within budget"""
+    # Best of 3, as the first run may also pay for imports and page faults
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        plan = SlicePlan(
+            '2024-01-01T00:00:00+01:00', '2025-11-25T10:40:00+01:00', '1m', tz='Europe/Berlin',
+            align=True)
+        timings.append(time.perf_counter() - start)
+    assert len(plan) == 1000000
+    assert plan[len(plan) - 1][1] - plan[0][0] == 1000000 * 60000
+    assert min(timings) < BUILD_BUDGET, f'building the plan took {min(timings):.2f}s'
@@ -0,0 +1,39 @@
+"""Cold start budget of the CLI"""
+import subprocess
+import sys
+
+#: Cumulative import time allowed for es_timeslicer.cli, in microseconds. It is about 30ms, most
+#: of which is click. Importing the Elasticsearch client as well takes over 200ms.
+BUDGET_US = 150000
+#: Packages which must only be imported by the commands which use them
+HEAVY = ['elasticsearch8', 'elastic_transport', 'es_client', 'voluptuous', 'pyarrow', 'ijson']
+
+def run(code):
+    """Run code in a fresh interpreter with -X importtime, and return its stdout and stderr"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, check=True)
+    return proc.stdout, proc.stderr
+
+def test_cli_import_time():
+    """Importing the CLI stays within the cold start budget"""
+    # Best of 3, as the first run may also pay for disk reads and bytecode compilation
+    timings = []
+    for _ in range(3):
+        _, importtime = run('import es_timeslicer.cli')
+        for line in importtime.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = [field.strip() for field in line.split('|')]
+            if len(fields) == 3 and fields[2] == 'es_timeslicer.cli':
+                timings.append(int(fields[1]))
+    assert timings, 'es_timeslicer.cli not found in the -X importtime output'
+    assert min(timings) < BUDGET_US, f'es_timeslicer.cli took {min(timings) / 1000:.0f}ms'
+
+def test_cli_import_is_light():
+    """Importing the CLI does not import the Elasticsearch client or other heavy packages"""
+    code = (
+        'import sys, es_timeslicer.cli\n'
+        'print(" ".join(sorted({name.split(".")[0] for name in sys.modules})))'
+    )
+    modules = set(run(code)[0].split())
+    assert not modules & set(HEAVY), f'imported {sorted(modules & set(HEAVY))}'
@@ -0,0 +1,185 @@
+"""Tests for the stream mode: fetching raw search responses, and their memory use"""
+import base64
+import json
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from es_timeslicer.helpers.streaming import get_header, search_raw, streamed_result
+
+pytest.importorskip('ijson')
+elasticsearch8 = pytest.importorskip('elasticsearch8')
+
+BUCKETS = 200000
+#: Peak traced memory allowed while streaming the buckets of the synthetic response
+BUDGET_MB = 25
+
+@pytest.fixture(name='raw', scope='module')
+def fixture_raw():
+    """A raw search response with BUCKETS terms buckets, about 14MB of JSON"""
+    buckets = [
+        {'key': f'host-{i}', 'doc_count': i, 'avg': {'value': i / 2}} for i in range(BUCKETS)]
+    return json.dumps({
+        'took': 5, 'timed_out': False, '_shards': {'total': 1, 'failed': 0},
+        'hits': {'total': {'value': BUCKETS}},
+        'aggregations': {'hosts': {'buckets': buckets}},
+    }).encode('utf-8')
+
+class Handler(BaseHTTPRequestHandler):
+    """Answer each request with the next of the server's replies, recording the request"""
+    def do_POST(self): # pylint: disable=invalid-name
+        """Reply with (status, body, delay), after sleeping delay seconds"""
+        length = int(self.headers.get('content-length', 0))
+        self.server.requests.append(
+            {'path': self.path, 'headers': dict(self.headers), 'body': self.rfile.read(length)})
+        status, body, delay = self.server.replies.pop(0)
+        time.sleep(delay)
+        try:
+            self.send_response(status)
+            self.send_header('content-type', 'application/json')
+            self.send_header('content-length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass # The client gave up waiting
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """Keep the test output quiet"""
+
+@pytest.fixture(name='server')
+def fixture_server():
+    """A local HTTP server, whose replies and received requests are lists"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.replies, server.requests = [], []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def client_for(server, **kwargs):
+    """Return an Elasticsearch client for the local server"""
+    return elasticsearch8.Elasticsearch(f'http://127.0.0.1:{server.server_port}', **kwargs)
+
+def reply(raw, status=200, delay=0):
+    """Return a server reply"""
+    return (status, raw, delay)
+
+def read(raw):
+    """Return the whole of a response body file"""
+    raw.seek(0)
+    return raw.read()
+
+def test_search_raw_request(server):
+    """The search goes to the index, with the query parameters, body and client headers"""
+    server.replies = [reply(b'{"took": 1}')]
+    client = client_for(
+        server, basic_auth=('elastic', 'secret'), headers={'x-opaque-id': 'timeslicer'})
+    raw = search_raw(client, 'logs-*,other', {'size': 0}, params={'ignore_unavailable': True})
+    assert read(raw) == b'{"took": 1}'
+    request = server.requests[0]
+    assert request['path'] == '/logs-*,other/_search?ignore_unavailable=true'
+    assert json.loads(request['body']) == {'size': 0}
+    headers = {key.lower(): value for key, value in request['headers'].items()}
+    token = base64.b64encode(b'elastic:secret').decode()
+    assert headers['authorization'] == f'Basic {token}'
+    assert headers['x-opaque-id'] == 'timeslicer'
+
+def test_search_raw_api_key(server):
+    """An API key is sent as the client would send it"""
+    server.replies = [reply(b'{}')]
+    search_raw(client_for(server, api_key='c2VjcmV0'), 'logs', {})
+    headers = {key.lower(): value for key, value in server.requests[0]['headers'].items()}
+    assert headers['authorization'] == 'ApiKey c2VjcmV0'
+
+def test_search_raw_retry_on_status(server):
+    """Statuses in retry_on_status are retried, up to max_retries"""
+    server.replies = [reply(b'{}', status=503), reply(b'{}', status=503), reply(b'{"took": 2}')]
+    client = client_for(server, retry_on_status=[503], max_retries=2)
+    assert read(search_raw(client, 'logs', {})) == b'{"took": 2}'
+    assert len(server.requests) == 3
+
+def test_search_raw_retries_exhausted(server):
+    """The last failed status is raised as an ApiError"""
+    server.replies = [reply(b'{"error": "busy"}', status=503)] * 2
+    client = client_for(server, retry_on_status=[503], max_retries=1)
+    with pytest.raises(elasticsearch8.ApiError) as excinfo:
+        search_raw(client, 'logs', {})
+    assert excinfo.value.meta.status == 503
+    assert 'busy' in excinfo.value.message
+    assert len(server.requests) == 2
+
+def test_search_raw_error_not_retried(server):
+    """Other errors are raised at once"""
+    server.replies = [reply(b'{"error": "bad"}', status=400)]
+    with pytest.raises(elasticsearch8.ApiError):
+        search_raw(client_for(server, retry_on_status=[503], max_retries=3), 'logs', {})
+    assert len(server.requests) == 1
+
+def test_search_raw_dead_node(server):
+    """A node which refuses the connection is marked dead, and the search retried on another"""
+    server.replies = [reply(b'{"took": 4}')] * 2
+    hosts = ['http://127.0.0.1:1', f'http://127.0.0.1:{server.server_port}']
+    client = elasticsearch8.Elasticsearch(hosts, retry_on_timeout=False)
+    for _ in range(2):
+        assert read(search_raw(client, 'logs', {})) == b'{"took": 4}'
+    assert len(server.requests) == 2
+
+def test_search_raw_retry_on_timeout(server):
+    """A request which times out is retried if retry_on_timeout is set, and raised if not"""
+    server.replies = [reply(b'{}', delay=1), reply(b'{"took": 3}')]
+    client = client_for(server, request_timeout=0.3, retry_on_timeout=True, max_retries=1)
+    assert read(search_raw(client, 'logs', {})) == b'{"took": 3}'
+    assert len(server.requests) == 2
+    server.replies = [reply(b'{}', delay=1)]
+    client = client_for(server, request_timeout=0.3, retry_on_timeout=False, max_retries=1)
+    with pytest.raises(elasticsearch8.ConnectionTimeout):
+        search_raw(client, 'logs', {})
+
+def peak_mb(func, *args):
+    """Return the result of func(*args), and the peak traced memory while it ran, in MB"""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        return result, tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+def consume(raw):
+    """Stream every bucket of raw, as an agg_function would, keeping only a running total"""
+    result = streamed_result(raw, 'hosts')
+    total = 0
+    for bucket in result['buckets']:
+        total += bucket['doc_count']
+    return result['took'], total
+
+def test_header_stops_at_aggregations(raw):
+    """The header has the keys before aggregations, and nothing after"""
+    header = get_header(raw)
+    assert header['hits']['total']['value'] == BUCKETS
+    assert 'aggregations' not in header
+
+def test_stream_peak_memory(raw):
+    """Streaming the buckets stays within budget, and well below decoding the whole response"""
+    (took, total), streamed = peak_mb(consume, raw)
+    assert took == 5
+    assert total == sum(range(BUCKETS))
+    decoded = peak_mb(json.loads, raw)[1]
+    assert streamed < BUDGET_MB, f'stream mode peaked at {streamed:.1f}MB'
+    assert streamed < decoded / 4, f'stream {streamed:.1f}MB vs decoded {decoded:.1f}MB'
+
+def test_fetch_and_stream_peak_memory(raw, server):
+    """Fetching the response with search_raw and streaming its buckets stays within budget"""
+    server.replies = [reply(raw)]
+    client = client_for(server)
+    def fetch_and_consume():
+        response = search_raw(client, 'logs', {'size': 0})
+        try:
+            return consume(response)
+        finally:
+            response.close()
+    (took, total), peak = peak_mb(fetch_and_consume)
+    assert (took, total) == (5, sum(range(BUCKETS)))
+    assert peak < BUDGET_MB, f'search_raw and stream mode peaked at {peak:.1f}MB'
@@ -0,0 +1,132 @@
+"""Tests for verify: per-slice counts, their comparison, and re-run plans"""
+import json
+import pytest
+from es_timeslicer.exceptions import ConfigurationException
+from es_timeslicer.helpers.slices import SlicePlan
+from es_timeslicer.helpers.utils import epoch_millis
+from es_timeslicer.helpers.verify import (
+    compare, count_slices, get_pattern, get_slice, read_plan)
+
+class Client:
+    """A stand-in for the Elasticsearch client, answering date_range aggregations"""
+    def __init__(self, documents):
+        #: Index name: list of (timestamp in epoch milliseconds, doc_count field)
+        self.documents = documents
+        self.searches = 0
+
+    def search(self, index, size, aggs, query):
+        """Count the documents of index in each range"""
+        # pylint: disable=unused-argument
+        self.searches += 1
+        agg = aggs['slices']
+        buckets = []
+        for span in agg['date_range']['ranges']:
+            found = [c for t, c in self.documents[index] if span['from'] <= t < span['to']]
+            bucket = {'from': float(span['from']), 'to': float(span['to']), 'doc_count': len(found)}
+            if 'aggs' in agg:
+                bucket['count'] = {'value': float(sum(found))}
+            buckets.append(bucket)
+        return {'aggregations': {'slices': {'buckets': buckets}}}
+
+def at(date):
+    """Return date in epoch milliseconds"""
+    return epoch_millis(date)
+
+@pytest.fixture(name='plan')
+def fixture_plan():
+    """Four hourly slices"""
+    return SlicePlan('2024-01-01T00:00:00+00:00', '2024-01-01T04:00:00+00:00', '1h')
+
+@pytest.fixture(name='client')
+def fixture_client():
+    """
+    Raw documents, and rollups with a doc_count field: the 00:00 slice is complete, 01:00 is
+    missing, 02:00 is short by one document, and 03:00 has a rollup but no raw documents
+    """
+    raw = [
+        (at(f'2024-01-01T0{hour}:{minute}:00+00:00'), 1) for hour in range(3)
+        for minute in (10, 20)
+    ]
+    rollup = [
+        (at('2024-01-01T00:00:00+00:00'), 2),
+        (at('2024-01-01T02:00:00+00:00'), 1),
+        (at('2024-01-01T03:00:00+00:00'), 5),
+    ]
+    return Client({'raw': raw, 'rollup': rollup})
+
+def test_count_slices(client, plan):
+    """Counts are keyed by slice start, with empty slices left out"""
+    hour = at('2024-01-01T00:00:00+00:00')
+    assert count_slices(client, 'raw', '@timestamp', plan) == {
+        hour: 2, hour + 3600000: 2, hour + 7200000: 2}
+    rollups = count_slices(client, 'rollup', '@timestamp', plan, count_field='doc_count')
+    assert list(rollups.values()) == [2, 1, 5]
+
+def test_count_slices_batches(client, monkeypatch, plan):
+    """Slices are counted MAX_BUCKETS at a time"""
+    monkeypatch.setattr('es_timeslicer.helpers.verify.MAX_BUCKETS', 3)
+    assert len(count_slices(client, 'raw', '@timestamp', plan)) == 3
+    assert client.searches == 2
+
+@pytest.mark.parametrize('exact, statuses', [
+    (False, ['missing', 'unexpected']),
+    (True, ['missing', 'mismatch', 'unexpected']),
+])
+def test_compare(client, plan, exact, statuses):
+    """Missing and unexpected slices are always reported, and mismatched counts if exact"""
+    read = count_slices(client, 'raw', '@timestamp', plan)
+    write = count_slices(client, 'rollup', '@timestamp', plan, count_field='doc_count')
+    report = list(compare(read, write, exact=exact))
+    assert [status for *_, status in report] == statuses
+    slices = {status: get_slice(plan, key) for key, _, _, status in report}
+    assert slices['missing'] == ('2024-01-01T01:00:00+00:00', '2024-01-01T02:00:00+00:00')
+    assert slices['unexpected'] == ('2024-01-01T03:00:00+00:00', '2024-01-01T04:00:00+00:00')
+    if exact:
+        assert slices['mismatch'] == ('2024-01-01T02:00:00+00:00', '2024-01-01T03:00:00+00:00')
+
+def test_get_slice_round_trip():
+    """Each slice start maps back to its slice, on an aligned plan across a DST change"""
+    plan = SlicePlan(
+        '2024-10-26T10:30:00+02:00', '2024-10-29T00:00:00+01:00', '1d', tz='Europe/Berlin',
+        align=True)
+    slices = list(plan)
+    assert [get_slice(plan, plan.boundaries[i]) for i in range(len(plan))] == slices
+    assert slices[0] == ('2024-10-26T10:30:00+02:00', '2024-10-27T00:00:00+02:00')
+    assert slices[1] == ('2024-10-27T00:00:00+02:00', '2024-10-28T00:00:00+01:00')
+
+def test_get_pattern():
+    """Only the slice_start and slice_end fields of a template become wildcards"""
+    assert get_pattern('rollup-{slice_start:%Y.%m}') == 'rollup-*'
+    assert get_pattern('rollup') == 'rollup'
+    assert get_pattern('rollup-{other}') == 'rollup-{other}'
+
+def test_read_plan(tmp_path):
+    """Plans are read sorted, skipping blank lines"""
+    path = tmp_path / 'plan.ndjson'
+    path.write_text(
+        '{"begin": "2024-01-01T01:00:00", "end": "2024-01-01T02:00:00"}\n\n'
+        '{"begin": "2024-01-01T00:00:00", "end": "2024-01-01T01:00:00", "read": 3}\n',
+        encoding='utf8')
+    assert read_plan(path) == [
+        ('2024-01-01T00:00:00', '2024-01-01T01:00:00'),
+        ('2024-01-01T01:00:00', '2024-01-01T02:00:00'),
+    ]
+
+@pytest.mark.parametrize('line', [
+    'not json',
+    json.dumps({'begin': '2024-01-01T00:00:00'}),
+    json.dumps({'begin': 'yesterday', 'end': '2024-01-01T00:00:00'}),
+    json.dumps({'begin': 5, 'end': '2024-01-01T00:00:00'}),
+    json.dumps(['2024-01-01T00:00:00', '2024-01-01T01:00:00']),
+])
+def test_read_plan_malformed(tmp_path, line):
+    """Malformed plan lines are configuration errors"""
+    path = tmp_path / 'plan.ndjson'
+    path.write_text(line + '\n', encoding='utf8')
+    with pytest.raises(ConfigurationException):
+        read_plan(path)
+
+def test_read_plan_missing(tmp_path):
+    """A missing plan file is a configuration error"""
+    with pytest.raises(ConfigurationException):
+        read_plan(tmp_path / 'missing.ndjson')